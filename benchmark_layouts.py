@@ -0,0 +1,49 @@
+import sys, time, random
+
+from igraph import *
+
+import numpy as np
+
+from layouts import calc_layout, layout_backends
+
+# Compares the running time of the layout backends on random contact networks of increasing size,
+# with the parameters used for the keyframes of the animations: a first layout from random positions
+# and then a layout seeded with the previous one. The "barnes_hut" backend uses the "fr" layout
+# below barnes_hut_min_vertices (see layouts.py).
+#
+# python benchmark_layouts.py [number of vertices ...]
+
+if 1 < len(sys.argv):
+    sizes = [int(n) for n in sys.argv[1:]]
+else:
+    sizes = [1000, 2000, 4000, 8000]
+
+# Average number of contacts per participant in a time window
+mean_degree = 4
+
+keyframe_niter = 50
+keyframe_start_temp = 0.3
+
+# Number of seeded layouts timed for each size
+nruns = 3
+
+print("vertices", "edges", *[backend + " first (s)" for backend in layout_backends],
+      *[backend + " seeded (s)" for backend in layout_backends], sep="\t")
+for n in sizes:
+    random.seed(n)
+    g = Graph.Erdos_Renyi(n=n, m=n * mean_degree // 2)
+    weights = [random.randint(1, 60) for e in range(g.ecount())]
+
+    first_times = []
+    seeded_times = []
+    for backend in layout_backends:
+        t0 = time.time()
+        layout = calc_layout(g, None, keyframe_niter, np.sqrt(n) / 10, weights, backend)
+        first_times += [time.time() - t0]
+
+        t0 = time.time()
+        for i in range(0, nruns):
+            layout = calc_layout(g, layout, keyframe_niter, keyframe_start_temp, weights, backend)
+        seeded_times += [(time.time() - t0) / nruns]
+
+    print(n, g.ecount(), *["%.3f" % t for t in first_times + seeded_times], sep="\t")
@@ -0,0 +1,99 @@
+import os, json, pickle, hashlib
+from os import path
+
+# On-disk cache of derived data (normalized events, status timelines, edge lists, layouts...) so
+# re-rendering a simulation with different colors, fonts or frame rates does not recompute them.
+# Each entry is keyed by a hash of the input files, the simulation properties that affect the
+# derived data, the name of the entry and any extra parameters used to compute it. The input files
+# are identified by the hash of their contents, so a new export invalidates the cache but copying or
+# touching the files does not, and the code that computes the entries by the hash of the sources of
+# the cache_modules, so a change in any of them invalidates the entries computed by the old code.
+
+# Simulation properties that affect the derived data
+cache_props = ["sim_id", "time_step_min", "time0", "time1", "use_new_id_schema"]
+
+# Modules whose code computes the derived data
+cache_modules = ["cache", "data_store", "event_index", "networks", "timeline", "layouts", "force_layout"]
+
+# Increase when the format of the cached data or the code that computes it in the plot scripts changes
+cache_version = 1
+
+def get_file_hash(fn, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+# Hash of the sources of the cache_modules
+def get_code_hash():
+    folder = path.dirname(path.abspath(__file__))
+    h = hashlib.sha256()
+    for m in cache_modules:
+        h.update(get_file_hash(path.join(folder, m + ".py")).encode())
+    return h.hexdigest()
+
+class DerivedCache:
+    def __init__(self, folder, props, input_files, max_size_mb=2048, enabled=True):
+        self.folder = folder
+        self.max_size = max_size_mb * 1024 * 1024
+        self.enabled = enabled
+        if enabled and not path.exists(folder):
+            os.makedirs(folder)
+
+        base = {"version": cache_version, "code": get_code_hash(), "props": {}, "inputs": []}
+        for k in cache_props:
+            if k in props:
+                base["props"][k] = props[k]
+        # Hashes of the contents, in the order of the files
+        if enabled:
+            base["inputs"] = [get_file_hash(fn) for fn in sorted(input_files)]
+        self.base = base
+
+    def get_key(self, name, params):
+        data = dict(self.base, name=name, params=params)
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_path(self, name, params):
+        return path.join(self.folder, name + "-" + self.get_key(name, params)[:24] + ".pkl")
+
+    # Returns the cached value of the entry, calling compute and storing its result if missing
+    def get(self, name, compute, params={}):
+        if not self.enabled:
+            return compute()
+
+        fn = self.get_path(name, params)
+        if path.exists(fn):
+            try:
+                with open(fn, "rb") as f:
+                    value = pickle.load(f)
+                # Mark the entry as recently used for the eviction
+                os.utime(fn)
+                print("Using cached", name)
+                return value
+            except Exception as e:
+                print("Cannot read cached", name + ":", e)
+
+        value = compute()
+        tmp_fn = fn + ".tmp"
+        with open(tmp_fn, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fn, fn)
+        self.evict()
+        return value
+
+    # Removes the least recently used entries until the cache fits in max_size
+    def evict(self):
+        entries = []
+        total = 0
+        for fn in os.listdir(self.folder):
+            if not fn.endswith(".pkl"): continue
+            st = os.stat(path.join(self.folder, fn))
+            entries += [(st.st_mtime, st.st_size, fn)]
+            total += st.st_size
+        entries.sort()
+        # The newest entry is always kept, even if it does not fit
+        for mtime, size, fn in entries[:-1]:
+            if total <= self.max_size: break
+            os.remove(path.join(self.folder, fn))
+            total -= size
@@ -0,0 +1,72 @@
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Animated line charts that build their figure once and only update the artists on each frame. The
+# axes, labels and ticks are rendered into a cached background, and every frame restores the
+# background and draws the lines up to the current frame, the vertical time marker, the spines and
+# the legend on top of it (blitting). The background is only rendered again when a new time label
+# appears.
+
+class ChartAnimator:
+    # series is a list of (values, label, color) with one value per frame, time_ticks are the frames
+    # with a time label and tlabels the labels, a frame only shows the labels reached so far.
+    def __init__(self, time_index, series, time_ticks, tlabels, xlim, ylim, ylabel, legend=False,
+                 figsize=(12, 8)):
+        self.time_index = time_index
+        self.values = [values for values, label, color in series]
+        self.time_ticks = np.asarray(time_ticks)
+        self.tlabels = tlabels
+
+        self.fig = Figure(figsize=figsize, facecolor="white")
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+
+        self.lines = []
+        for values, label, color in series:
+            line, = self.ax.plot([], [], label=label, color=color, lw=2, animated=True)
+            self.lines += [line]
+        self.marker = self.ax.axvline(x=0, color="dimgray", lw=1, animated=True)
+        # The spines are drawn over the lines and the marker
+        for spine in self.ax.spines.values():
+            spine.set_animated(True)
+        self.legend = None
+        if legend:
+            self.legend = self.ax.legend(loc='upper right')
+            self.legend.set_animated(True)
+
+        self.ax.set_ylim(ylim)
+        self.ax.set_xlim(xlim)
+        self.ax.set_xlabel("Time", labelpad=15, fontsize=15)
+        self.ax.set_ylabel(ylabel, labelpad=15, fontsize=15)
+
+        self.nticks = -1
+        self.background = None
+
+    def update_background(self, nticks):
+        self.ax.set_xticks(self.time_ticks[:nticks], self.tlabels[:nticks], rotation=45, horizontalalignment="right")
+        self.fig.tight_layout()
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.nticks = nticks
+
+    # Returns the pixels of the frame as an RGB array of shape (height, width, 3)
+    def render(self, frame):
+        nticks = np.searchsorted(self.time_ticks, frame, side="right")
+        if nticks != self.nticks:
+            self.update_background(nticks)
+
+        self.canvas.restore_region(self.background)
+        n = frame + 1
+        for line, values in zip(self.lines, self.values):
+            line.set_data(self.time_index[:n], values[:n])
+            self.ax.draw_artist(line)
+        self.marker.set_xdata([frame, frame])
+        self.ax.draw_artist(self.marker)
+        for spine in self.ax.spines.values():
+            self.ax.draw_artist(spine)
+        if self.legend is not None:
+            self.ax.draw_artist(self.legend)
+
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
@@ -0,0 +1,183 @@
+import os, csv
+from os import path
+
+import numpy as np
+import pandas as pd
+
+# Columnar store of the OO data folder. Each CSV export is converted once (see import_data.py)
+# into a Parquet dataset partitioned by simulation, so the plotting scripts only read the rows
+# and columns of the simulation they are rendering instead of parsing the full CSV every time.
+
+store_folder_name = "store"
+
+# Tables in the data folder and the column used to partition each of them
+store_tables = {"participants": "sim_id",
+                "histories": "sim_id",
+                "mutations": "sim_id",
+                "sequences": "pathogen_id"}
+
+# Column types for the known numeric columns, everything else is stored as a (nullable) string.
+# peer_id and p2p_id are kept as strings because they hold p2p ids in the old id schema.
+numeric_columns = {"sim_id": "int64",
+                   "pathogen_id": "int64",
+                   "id": "int64",
+                   "user_id": "int64",
+                   "prev_mutation_id": "int64",
+                   "time": "float64",
+                   "contact_length": "float64"}
+
+# Columns used by the plotting scripts
+user_columns = ["sim_id", "id", "p2p_id"]
+event_columns = ["sim_id", "user_id", "type", "time", "contact_length", "peer_id", "inf", "out"]
+
+def get_store_folder(data_folder):
+    return path.join(data_folder, store_folder_name)
+
+def has_store(data_folder, name):
+    return path.exists(path.join(get_store_folder(data_folder), name))
+
+# Files read by load_table for the rows with key_value
+def get_input_files(data_folder, name, key_value):
+    if has_store(data_folder, name):
+        folder = path.join(get_store_folder(data_folder), name, store_tables[name] + "=" + str(key_value))
+        if not path.exists(folder):
+            return []
+        return [path.join(folder, fn) for fn in sorted(os.listdir(folder))]
+    return [path.join(data_folder, name + ".csv")]
+
+def import_table(data_folder, name, block_size=64 << 20):
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+    import pyarrow.dataset as ds
+
+    csv_fn = path.join(data_folder, name + ".csv")
+    if not path.exists(csv_fn):
+        return False
+
+    with open(csv_fn, newline='') as f:
+        header = next(csv.reader(f))
+
+    key = store_tables[name]
+    column_types = {}
+    for col in header:
+        if col in numeric_columns:
+            column_types[col] = pa.type_for_alias(numeric_columns[col])
+        else:
+            column_types[col] = pa.string()
+
+    # Stream the CSV in blocks so files with every simulation ever run do not need to fit in memory
+    reader = pcsv.open_csv(csv_fn,
+                           read_options=pcsv.ReadOptions(block_size=block_size),
+                           convert_options=pcsv.ConvertOptions(column_types=column_types,
+                                                                strings_can_be_null=True))
+
+    partitioning = ds.partitioning(pa.schema([(key, pa.int64())]), flavor="hive")
+    ds.write_dataset(reader, path.join(get_store_folder(data_folder), name), format="parquet",
+                     partitioning=partitioning, existing_data_behavior="delete_matching")
+    return True
+
+def load_table(data_folder, name, key_value, columns=None):
+    key = store_tables[name]
+    if has_store(data_folder, name):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        partitioning = ds.partitioning(pa.schema([(key, pa.int64())]), flavor="hive")
+        dataset = ds.dataset(path.join(get_store_folder(data_folder), name), format="parquet",
+                             partitioning=partitioning)
+        if columns is not None:
+            columns = [col for col in columns if col in dataset.schema.names]
+        table = dataset.to_table(columns=columns, filter=ds.field(key) == key_value)
+        return table.to_pandas()
+
+    # No columnar store, fall back to the CSV but keep only the rows of this simulation
+    print("No columnar store for", name + ", reading CSV (run import_data.py to create it)")
+    csv_fn = path.join(data_folder, name + ".csv")
+    usecols = None
+    if columns is not None:
+        usecols = lambda col: col in columns
+    chunks = []
+    for chunk in pd.read_csv(csv_fn, usecols=usecols, chunksize=1 << 20):
+        chunks += [chunk[chunk[key] == key_value]]
+    return pd.concat(chunks, ignore_index=True)
+
+def load_users(data_folder, sim_id, columns=user_columns):
+    return load_table(data_folder, "participants", sim_id, columns)
+
+def load_events(data_folder, sim_id, use_new_id_schema, columns=event_columns):
+    events = load_table(data_folder, "histories", sim_id, columns)
+    # Events are processed in time order (e.g. by the incremental infection builder)
+    events = events.sort_values(by="time", kind="stable", ignore_index=True)
+    events.fillna({'contact_length':0}, inplace=True)
+    events["event_start"] = events["time"] - events["contact_length"]/1000
+    events["event_start"] = events["event_start"].astype(int, errors = 'ignore')
+    if use_new_id_schema:
+        events["peer_id"] = pd.to_numeric(events["peer_id"], errors='coerce').fillna(-1).astype(int)
+    else:
+        # Old schema: peer_id holds p2p ids
+        events["peer_id"] = events["peer_id"].astype(object).fillna(-1)
+    return events
+
+# Event kinds in the normalized event table
+other_event = 0
+contact_event = 1
+infection_event = 2
+outcome_event = 3
+
+event_kinds = {"contact": contact_event, "infection": infection_event, "outcome": outcome_event}
+
+# Status codes set by the outcome events
+outcome_status = {"DEAD": 3, "RECOVERED": 4, "VACCINATED": 5}
+
+# Adds integer columns with the events resolved to node indices (positions in user_index), so the
+# time window loops do not need to parse strings or look up ids:
+# kind: one of the event kinds above
+# src_node: user for contacts, infecting peer for infections, -1 if missing or not applicable
+# dst_node: peer for contacts, infected or affected user for infections and outcomes
+# outcome: status code the event gives to dst_node (1 index case, 2 infected by peer, 3 dead,
+# 4 recovered, 5 vaccinated), 0 if none
+def normalize_events(events, user_index, p2pToId, use_new_id_schema, print_data_warnings=True):
+    kind = events["type"].map(event_kinds).fillna(other_event).astype("int8")
+    is_contact = (kind == contact_event).values
+    is_infection = (kind == infection_event).values
+    is_outcome = (kind == outcome_event).values
+
+    user_node = events["user_id"].map(user_index).fillna(-1).astype(int).values
+
+    # Peers in the contact events
+    if use_new_id_schema:
+        peer_node = events["peer_id"].map(user_index)
+    else:
+        peer_node = events["peer_id"].map(p2pToId).map(user_index)
+    peer_node = peer_node.fillna(-1).astype(int).values
+
+    # Peers in the infection column, "PEER[id:...]" where id is the p2p id in the old schema
+    inf = events["inf"].where(is_infection)
+    is_case0 = inf.str.contains("CASE0", na=False, regex=False).values
+    is_peer = inf.str.contains("PEER", na=False, regex=False).values
+    peer0 = inf.str.extract(r"\[([^:]*):", expand=False)
+    if use_new_id_schema:
+        inf_node = pd.to_numeric(peer0, errors='coerce').map(user_index)
+    else:
+        inf_node = peer0.map(p2pToId).map(user_index)
+    inf_node = inf_node.fillna(-1).astype(int).values
+
+    if print_data_warnings:
+        for id1 in events["peer_id"].values[is_contact & (peer_node == -1)]:
+            print("Cannot find peer", id1)
+        for id0 in peer0.values[is_peer & (inf_node == -1)]:
+            print("Cannot find peer", id0)
+
+    src_node = np.full(len(events), -1)
+    src_node[is_contact] = user_node[is_contact]
+    src_node[is_peer] = inf_node[is_peer]
+
+    dst_node = user_node.copy()
+    dst_node[is_contact] = peer_node[is_contact]
+
+    outcome = events["out"].where(is_outcome).map(outcome_status).fillna(0).values.astype("int8")
+    outcome[is_infection & is_case0] = 1
+    outcome[is_infection & is_peer] = 2
+
+    events = events.assign(kind=kind.values, src_node=src_node, dst_node=dst_node, outcome=outcome)
+    return events
@@ -0,0 +1,39 @@
+import numpy as np
+
+# Index of the events of a simulation sorted by end time and by start time, so the events of
+# each time window are found with binary searches instead of a mask over the whole table.
+
+class EventIndex:
+    def __init__(self, events):
+        self.events = events
+        time = events["time"].values
+        start = events["event_start"].values
+        self.time_order = np.argsort(time, kind="stable")
+        self.start_order = np.argsort(start, kind="stable")
+        self.sorted_time = time[self.time_order]
+        self.sorted_start = start[self.start_order]
+
+    # Row positions of the events that either started or ended in (t0, t1], in table order
+    def window_rows(self, t0, t1):
+        i0, i1 = np.searchsorted(self.sorted_start, [t0, t1], side="right")
+        j0, j1 = np.searchsorted(self.sorted_time, [t0, t1], side="right")
+        return np.union1d(self.start_order[i0:i1], self.time_order[j0:j1])
+
+    def window(self, t0, t1):
+        return self.events.iloc[self.window_rows(t0, t1)]
+
+    # Row positions of the events that ended in (t0, t1], in table order
+    def ended_rows(self, t0, t1):
+        j0, j1 = np.searchsorted(self.sorted_time, [t0, t1], side="right")
+        return np.sort(self.time_order[j0:j1])
+
+    def ended(self, t0, t1):
+        return self.events.iloc[self.ended_rows(t0, t1)]
+
+    # Row positions of the events that ended at or before t1, in table order
+    def until_rows(self, t1):
+        j1 = np.searchsorted(self.sorted_time, t1, side="right")
+        return np.sort(self.time_order[:j1])
+
+    def until(self, t1):
+        return self.events.iloc[self.until_rows(t1)]
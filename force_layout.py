@@ -0,0 +1,192 @@
+import random
+
+import numpy as np
+
+# Force-directed layout with the same model as igraph's fruchterman-reingold layout without grid
+# (repulsion 1 / d between all the vertices, attraction d^2 * weight along the edges, displacement
+# limited by a temperature that decreases linearly to 0), where the repulsion between distant
+# vertices is approximated by the centers of mass of the cells of a quadtree, as in the Barnes-Hut
+# algorithm, so each iteration is O(n log n) instead of O(n^2).
+#
+# The quadtree is stored as a dense grid for each level, so the cells that act on each vertex are
+# found with array arithmetic instead of traversing the tree. As in the fast multipole method, at
+# each level L a vertex interacts with the cells that are children of the neighbors of the parent
+# of its cell, but are not neighbors of its cell (27 cells, at least one cell width away), and at
+# the finest level with the vertices of its own and the neighboring cells, exactly. These cells
+# cover the plane once for each vertex.
+
+max_depth = 10
+
+# Offsets of the interaction list for the cells at each parity of x and y, as a (2, 2, 27, 2) array
+def get_interaction_offsets():
+    offsets = np.empty((2, 2, 27, 2), dtype=np.int64)
+    for bx in (0, 1):
+        for by in (0, 1):
+            k = 0
+            for dx in range(-2 - bx, 4 - bx):
+                for dy in range(-2 - by, 4 - by):
+                    if 1 < abs(dx) or 1 < abs(dy):
+                        offsets[bx, by, k] = (dx, dy)
+                        k += 1
+    return offsets
+
+interaction_offsets = get_interaction_offsets()
+neighbor_offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype=np.int64)
+
+# The grids are padded with 3 empty cells on each side, so the cells of the interaction lists are
+# always inside the grid
+pad = 3
+
+# Percentiles of the positions of the vertices covered by the grid
+bulk_percentile = 2
+
+# Relative cost of an exact pair of the finest level and of a cell of an interaction list, used to
+# choose the depth of the grid
+pair_cost = 4
+
+# Padded (side + 2 * pad) x (side + 2 * pad) grid, as a flat array, from a side x side grid
+def pad_grid(values, side, fill=0):
+    padded = np.full((side + 2 * pad, side + 2 * pad), fill, dtype=values.dtype)
+    padded[pad:pad + side, pad:pad + side] = values.reshape(side, side)
+    return padded.ravel()
+
+# Sum of the 2 x 2 blocks of a side x side grid
+def coarsen_grid(values, side):
+    return values.reshape(side // 2, 2, side // 2, 2).sum(axis=(1, 3)).ravel()
+
+# Number of vertices in the 3 x 3 block around each cell of a side x side grid of counts
+def get_block_counts(counts, side):
+    padded = pad_grid(counts, side).reshape(side + 2 * pad, side + 2 * pad)
+    block = np.zeros((side, side), dtype=counts.dtype)
+    for dx, dy in neighbor_offsets:
+        block += padded[pad + dx:pad + dx + side, pad + dy:pad + dy + side]
+    return block.ravel()
+
+# Deterministic direction for the pairs of coincident vertices, opposite for (i, j) and (j, i), so
+# the vertices are pushed apart as in igraph, which uses a small random displacement
+def get_jitter(i, j):
+    k = i - j
+    angle = 2.399963 * np.abs(k)
+    return 1e-9 * np.sign(k)[:, None] * np.stack((np.cos(angle), np.sin(angle)), axis=1)
+
+# Approximate repulsion on each vertex, sum of (p - q) / |p - q|^2 over the other vertices q
+def calc_repulsion(pos, depth=None):
+    n = len(pos)
+    force = np.zeros((n, 2))
+    if n < 2: return force
+
+    # The grid covers the bulk of the vertices, the vertices that are far away (such as the isolated
+    # ones, that keep drifting away) are clipped into the border cells, which still have their
+    # actual centers of mass
+    lo, hi = np.percentile(pos, [bulk_percentile, 100 - bulk_percentile], axis=0)
+    size = (hi - lo).max() * 1.05
+    lo -= 0.025 * size
+    if size == 0: size = 1
+    # The depth is chosen among the levels around the one with about one vertex per cell
+    top = min(max_depth, int(np.ceil(np.log2(n) / 2)) + 2) if depth is None else depth
+    grid = np.clip(((pos - lo) * ((1 << top) / size)), 0, (1 << top) - 1).astype(np.int64)
+
+    # Number of vertices of the cells at each level, from the deepest one
+    counts = [np.bincount(grid[:, 0] << top | grid[:, 1], minlength=1 << 2 * top)]
+    for level in range(top, 2, -1):
+        counts.insert(0, coarsen_grid(counts[0], 1 << level))
+    counts = [None, None] + counts
+
+    # The deepest levels have fewer exact pairs but more cells in the interaction lists
+    if depth is None:
+        costs = [pair_cost * (counts[d] * get_block_counts(counts[d], 1 << d)).sum() + 27 * (d - 1) * n
+                 for d in range(max(2, top - 3), top + 1)]
+        depth = max(2, top - 3) + int(np.argmin(costs))
+    grid >>= top - depth
+    side = 1 << depth
+
+    cells = grid[:, 0] * side + grid[:, 1]
+    # The far cells are added in single precision
+    pos32 = pos.astype(np.float32)
+    sum_x = np.bincount(cells, weights=pos[:, 0], minlength=side * side)
+    sum_y = np.bincount(cells, weights=pos[:, 1], minlength=side * side)
+    for level in range(depth, 1, -1):
+        width = 1 << level
+        if level < depth:
+            sum_x = coarsen_grid(sum_x, width * 2)
+            sum_y = coarsen_grid(sum_y, width * 2)
+        # Centers of mass of the cells, the empty cells are far away and have no mass
+        mass = counts[level]
+        m = np.maximum(mass, 1)
+        com_x = pad_grid(np.where(0 < mass, sum_x / m, 1e18).astype(np.float32), width, 1e18)
+        com_y = pad_grid(np.where(0 < mass, sum_y / m, 1e18).astype(np.float32), width, 1e18)
+        mass = pad_grid(mass.astype(np.float32), width)
+
+        gx = grid[:, 0] >> (depth - level)
+        gy = grid[:, 1] >> (depth - level)
+        offsets = interaction_offsets[:, :, :, 0] * (width + 2 * pad) + interaction_offsets[:, :, :, 1]
+        other = ((gx + pad) * (width + 2 * pad) + gy + pad)[:, None] + offsets[gx & 1, gy & 1]
+        dx = pos32[:, 0, None] - com_x[other]
+        dy = pos32[:, 1, None] - com_y[other]
+        f = mass[other] / (dx * dx + dy * dy)
+        force[:, 0] += np.einsum("ij,ij->i", dx, f)
+        force[:, 1] += np.einsum("ij,ij->i", dy, f)
+
+    # Exact repulsion of the vertices in the same and the neighboring cells at the finest level
+    order = np.argsort(cells, kind="stable")
+    cell_counts = pad_grid(counts[depth], side)
+    starts = np.cumsum(cell_counts) - cell_counts
+    other = ((grid[:, 0] + pad) * (side + 2 * pad) + grid[:, 1] + pad)[:, None] + \
+            neighbor_offsets[:, 0] * (side + 2 * pad) + neighbor_offsets[:, 1]
+    pair_counts = cell_counts[other].ravel()
+    first = np.repeat(starts[other].ravel(), pair_counts)
+    total = np.cumsum(pair_counts)
+    i = np.repeat(np.arange(n), pair_counts.reshape(n, 9).sum(axis=1))
+    j = order[first + np.arange(len(first)) - np.repeat(total - pair_counts, pair_counts)]
+    keep = i != j
+    i = i[keep]
+    j = j[keep]
+    delta = pos[i] - pos[j]
+    dist2 = (delta * delta).sum(axis=1)
+    same = dist2 == 0
+    if same.any():
+        delta[same] = get_jitter(i[same], j[same])
+        dist2[same] = (delta[same] * delta[same]).sum(axis=1)
+    f = delta / dist2[:, None]
+    force[:, 0] += np.bincount(i, weights=f[:, 0], minlength=n)
+    force[:, 1] += np.bincount(i, weights=f[:, 1], minlength=n)
+
+    return force
+
+# Layout of the graph with niter iterations starting at start_temp, seeded with an (n, 2) array or
+# random positions if seed is None. The random positions use the random module, as igraph does.
+def layout_barnes_hut(g, seed=None, niter=500, start_temp=None, weights=None):
+    n = g.vcount()
+    if start_temp is None:
+        start_temp = np.sqrt(n) / 10
+    if seed is None:
+        rng = np.random.default_rng(random.getrandbits(32))
+        pos = rng.uniform(-np.sqrt(n) / 2, np.sqrt(n) / 2, size=(n, 2))
+    else:
+        pos = np.array(seed, dtype=float)
+
+    edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    if weights is None:
+        w = np.ones(len(edges))
+    else:
+        w = np.asarray(weights, dtype=float)
+
+    temp = start_temp
+    diff_temp = start_temp / niter
+    for i in range(0, niter):
+        force = calc_repulsion(pos)
+
+        if 0 < len(edges):
+            delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+            f = delta * (np.sqrt((delta * delta).sum(axis=1)) * w)[:, None]
+            for k in (0, 1):
+                force[:, k] -= np.bincount(edges[:, 0], weights=f[:, k], minlength=n)
+                force[:, k] += np.bincount(edges[:, 1], weights=f[:, k], minlength=n)
+
+        # The displacement is limited by the temperature
+        length = np.sqrt((force * force).sum(axis=1))
+        scale = np.where(temp < length, temp / np.maximum(length, 1e-12), 1)
+        pos += force * scale[:, None]
+        temp -= diff_temp
+
+    return pos
@@ -0,0 +1,29 @@
+import sys, json
+from os import path
+
+from data_store import store_tables, import_table, get_store_folder
+
+# Load properties
+if len(sys.argv) < 2:
+    print("JSON files with simulation properties are missing")
+    exit(1)
+
+json_fname = sys.argv[1]
+with open(json_fname) as f:
+    props = json.load(f)
+
+base_folder = props["base_folder"]
+data_folder = path.join(base_folder, "data")
+
+# Converts every CSV in the data folder into the columnar store used by the plotting scripts.
+# This needs to be re-run whenever the CSV files are exported again.
+
+print("Importing data into", get_store_folder(data_folder))
+for name in store_tables:
+    print(name + "...", end=" ")
+    if import_table(data_folder, name):
+        print("Done")
+    else:
+        print("Missing CSV file, skipping")
+
+print("DONE")
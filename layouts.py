@@ -0,0 +1,137 @@
+import random
+
+import numpy as np
+from igraph import Graph
+
+from force_layout import layout_barnes_hut
+
+# Layouts of the animated networks. In "incremental" mode the fruchterman-reingold (fr) algorithm
+# runs for a few iterations on every frame, seeded with the layout of the previous frame. In
+# "keyframe" mode it runs once per time window, seeded with the previous keyframe, and the frames
+# in between are interpolated, so the number of frames does not change the layout cost.
+# Consecutive frames where the vertices do not move are rendered once and held (see get_frame_holds).
+
+easing_functions = {"linear": lambda a: a,
+                    "ease": lambda a: a * a * (3 - 2 * a)}
+
+# Number of layouts calculated for a window of the given number of frames
+def get_layouts_per_window(layout_mode, anim_steps):
+    if layout_mode == "keyframe":
+        return 1
+    return anim_steps
+
+def calc_layout_fr(g, seed, niter, start_temp, weights=None):
+    # https://igraph.org/python/api/latest/igraph._igraph.GraphBase.html#layout_fruchterman_reingold
+    if seed is not None:
+        seed = seed.tolist()
+    layout = g.layout_fruchterman_reingold(niter=niter, start_temp=start_temp, grid='nogrid', weights=weights, seed=seed)
+    return np.array(layout.coords)
+
+# Below this number of vertices igraph's exact layout is faster than the approximation
+barnes_hut_min_vertices = 1500
+
+def calc_layout_barnes_hut(g, seed, niter, start_temp, weights=None):
+    if g.vcount() < barnes_hut_min_vertices:
+        return calc_layout_fr(g, seed, niter, start_temp, weights)
+    return layout_barnes_hut(g, seed, niter, start_temp, weights)
+
+# Layout algorithms: "fr" is igraph's fruchterman-reingold, O(n^2) per iteration, and "barnes_hut"
+# the same force model with the repulsion approximated on a quadtree (see force_layout.py), which
+# scales better with large numbers of participants and uses "fr" for the small graphs
+layout_backends = {"fr": calc_layout_fr,
+                   "barnes_hut": calc_layout_barnes_hut}
+
+def calc_layout(g, seed, niter, start_temp, weights=None, backend="fr"):
+    return layout_backends[backend](g, seed, niter, start_temp, weights)
+
+# Layout where only the active vertices move, seeded with layout0, while the other vertices stay
+# parked at their positions in layout0. The edges of g should only join active vertices.
+def calc_active_layout(g, weights, active, layout0, niter, start_temp, backend="fr"):
+    layout = layout0.copy()
+    if len(active) == 0:
+        return layout
+    local = np.full(g.vcount(), -1, dtype=np.int64)
+    local[active] = np.arange(len(active))
+    edges = np.array(g.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    ga = Graph(n=len(active), edges=local[edges].tolist(), directed=g.is_directed())
+    layout[active] = calc_layout(ga, layout0[active], niter, start_temp, weights, backend)
+    return layout
+
+# Layouts for a sequence of graphs, one per time window, as a float32 array of shape
+# (nwindows * layouts per window, nvert, 2). get_graph returns the graph and the edge weights of
+# each window. If hold_static is true, the windows with the same graph as the previous window keep
+# its last layout instead of running the layout algorithm again, so their frames do not change, once
+# the layout has converged: the last run of the algorithm did not move any vertex hold_tolerance
+# pixels or more, with the layouts fitted into a drawing area of size frame_size.
+# igraph uses the random module, seeding it makes the layouts reproducible so the parts of a movie
+# rendered on different machines match. backend is one of the layout_backends. If active_decay is
+# larger than 0, after the first layout the algorithm only runs on the vertices with edges in the
+# last active_decay windows, and the other vertices are parked where they were, so the layout cost
+# follows the number of active vertices instead of nvert.
+def calc_window_layouts(get_graph, nwindows, nvert, layout_mode, anim_steps, niter, start_temp, hold_static=False,
+                        seed=None, backend="fr", active_decay=0, hold_tolerance=0, frame_size=(1, 1)):
+    if seed is not None:
+        random.seed(seed)
+    nlayouts = get_layouts_per_window(layout_mode, anim_steps)
+    layouts = np.zeros((nwindows * nlayouts, nvert, 2), dtype=np.float32)
+    layout0 = None
+    graph0 = None
+    converged = False
+    # Last window where each vertex had an edge
+    last_active = np.full(nvert, -nwindows - 1)
+    k = 0
+    for w in range(0, nwindows):
+        g, weights = get_graph(w)
+        graph = (g.get_edgelist(), weights)
+        if 0 < active_decay:
+            last_active[np.array(graph[0], dtype=np.int64).ravel()] = w
+            active = np.flatnonzero(w - last_active < active_decay)
+        for i in range(0, nlayouts):
+            if not hold_static or layout0 is None or graph != graph0 or not converged:
+                previous = layout0
+                if 0 < active_decay and layout0 is not None:
+                    layout0 = calc_active_layout(g, weights, active, layout0, niter, start_temp, backend)
+                else:
+                    layout0 = calc_layout(g, layout0, niter, start_temp, weights, backend)
+                if hold_static and previous is not None:
+                    pixels = get_pixel_layouts(np.stack((previous, layout0)), frame_size[0], frame_size[1])
+                    converged = np.abs(pixels[1] - pixels[0]).max() <= hold_tolerance
+            layouts[k] = layout0
+            k += 1
+        graph0 = graph
+    return layouts
+
+# Vectorized interpolation of the nframes frames going from layout0 to layout1, the last frame
+# is layout1
+def interpolate_layouts(layout0, layout1, nframes, easing="linear"):
+    alpha = easing_functions[easing](np.arange(1, nframes + 1) / nframes)
+    return layout0[None, :, :] + alpha[:, None, None] * (layout1 - layout0)[None, :, :]
+
+# Layouts of the frames in window w
+def get_frame_layouts(layouts, w, layout_mode, anim_steps, easing="linear"):
+    if layout_mode == "keyframe":
+        return interpolate_layouts(layouts[max(w - 1, 0)], layouts[w], anim_steps, easing)
+    return layouts[w * anim_steps:(w + 1) * anim_steps]
+
+# Pixel coordinates of the vertices in the frame layouts of shape (nframes, nvert, 2), up to a
+# translation, when igraph fits them into a drawing area of the given size by scaling each axis
+def get_pixel_layouts(frame_layouts, width, height):
+    mins = frame_layouts.min(axis=1, keepdims=True)
+    sizes = frame_layouts.max(axis=1, keepdims=True) - mins
+    mins = np.where(sizes == 0, mins - 1, mins)
+    sizes = np.where(sizes == 0, 2, sizes)
+    return (frame_layouts - mins) * (np.array([width, height]) / sizes)
+
+# Number of frames that each frame is held for, given the pixel coordinates of the vertices in the
+# frames of a window: a frame is held while no vertex moves tolerance pixels or more away from it.
+# The frames covered by a previous frame have a count of 0.
+def get_frame_holds(pixel_layouts, tolerance):
+    nframes = len(pixel_layouts)
+    holds = np.zeros(nframes, dtype=int)
+    start = 0
+    for i in range(1, nframes):
+        if tolerance <= np.abs(pixel_layouts[i] - pixel_layouts[start]).max():
+            holds[start] = i - start
+            start = i
+    holds[start] = nframes - start
+    return holds
@@ -0,0 +1,173 @@
+import numpy as np
+from igraph import Graph
+
+from data_store import contact_event, infection_event
+
+# Builders for the contact and infection networks
+
+# Contact minutes between each pair of nodes in the events, as an (n, 2) array of edges with
+# n0 < n1 and the corresponding array of weights. Transmissions without a registered contact
+# are added with def_contact_time minutes.
+def get_contact_list(events, infections, nvert, def_contact_time, print_data_warnings=True):
+    sel = (events["kind"].values == contact_event) & (-1 < events["dst_node"].values)
+    node0 = events["src_node"].values[sel]
+    node1 = events["dst_node"].values[sel]
+    minutes = np.round(events["contact_length"].values[sel] / (60 * 1000))
+
+    keys = np.minimum(node0, node1) * nvert + np.maximum(node0, node1)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, weights=minutes, minlength=len(keys)).astype(int)
+
+    # Adding contacts from transmissions if they are not registered as contacts already
+    if 0 < len(infections):
+        inf = np.array(infections, dtype=int)
+        ikeys = np.unique(np.minimum(inf[:, 0], inf[:, 1]) * nvert + np.maximum(inf[:, 0], inf[:, 1]))
+        missing = ikeys[~np.isin(ikeys, keys)]
+        if print_data_warnings:
+            for k in missing:
+                print("Cannot find contact between", k // nvert, "and", k % nvert)
+        keys = np.concatenate((keys, missing))
+        weights = np.concatenate((weights, np.full(len(missing), def_contact_time, dtype=int)))
+
+    edges = np.column_stack((keys // nvert, keys % nvert))
+    return edges, weights
+
+# Transmission graph built incrementally from the infection events, which need to be added
+# in time order. The edges are indexed by infectee so that the duplicated and multiple infection
+# checks do not scan the whole edge list, and the edge list is available at any time step.
+class InfectionBuilder:
+    def __init__(self, index_user, use_new_id_schema, time_delta_sec, print_data_warnings=True):
+        self.index_user = index_user
+        self.use_new_id_schema = use_new_id_schema
+        self.time_delta_sec = time_delta_sec
+        self.print_data_warnings = print_data_warnings
+
+        self.edges = []
+        # Infectors of each infectee, in the order in which the edges were added
+        self.infectors = {}
+        # Time of the last infection for each (infector, infectee) edge
+        self.itimes = {}
+        self.edge_set = set()
+
+    # Adds the infections from peers in the normalized events (see data_store.normalize_events)
+    def add(self, events):
+        sel = (events["kind"].values == infection_event) & (-1 < events["src_node"].values)
+        node0 = events["src_node"].values[sel]
+        node1 = events["dst_node"].values[sel]
+        timestamp = events["time"].values[sel]
+        for n0, n1, ts in zip(node0.tolist(), node1.tolist(), timestamp.tolist()):
+            if self.use_new_id_schema:
+                self.add_infection(n0, n1, ts)
+            else:
+                # Old schema (sims before 2022): same infector and infectee is always a duplicate
+                self.add_infection_old_schema(n0, n1)
+
+        return self
+
+    def add_infection(self, n0, n1, ts):
+        if n1 in self.infectors:
+            time_step_min = int(self.time_delta_sec / 60)
+            for p0 in self.infectors[n1]:
+                ts0 = self.itimes[(p0, n1)]
+                if abs(ts - ts0) <= self.time_delta_sec:
+                    id0 = self.index_user[n0]
+                    id1 = self.index_user[n1]
+                    pid0 = self.index_user[p0]
+                    if p0 == n0:
+                        print("Duplicated infection:", id1, "was already infected by", id0, "in the last", time_step_min, "minutes")
+                    else:
+                        print("Multiple infection:", id1, "is being infected by", id0, "but was already infected by", pid0, "in the last", time_step_min, "minutes")
+                    return False
+        else:
+            self.infectors[n1] = []
+
+        self.edges += [(n0, n1)]
+        self.infectors[n1] += [n0]
+        self.itimes[(n0, n1)] = ts
+        return True
+
+    def add_infection_old_schema(self, n0, n1):
+        if (n0, n1) in self.edge_set:
+            if self.print_data_warnings:
+                print("Duplicated infection", self.index_user[n0], self.index_user[n1])
+            return False
+
+        self.edges += [(n0, n1)]
+        self.edge_set.add((n0, n1))
+        return True
+
+# Graph with a fixed set of vertices that is updated in place from one time window to the next,
+# instead of building a new igraph Graph for each window: set_edges only deletes and adds the edges
+# that changed and set_status only recolors the vertices whose status changed. The edges and the
+# weights are also kept as arrays in the order of the igraph edges, so the degrees and weights are
+# available without iterating over the graph.
+class TemporalGraph:
+    def __init__(self, nvert, directed, palette=None):
+        self.nvert = nvert
+        self.directed = directed
+        self.palette = palette
+
+        self.graph = Graph(n=nvert, directed=directed)
+        self.edges = np.zeros((0, 2), dtype=np.int64)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.weights = None
+        self.status = None
+
+    # Keys that identify the edges, repeated edges are told apart by their order of occurrence
+    def get_keys(self, edges):
+        n0 = edges[:, 0]
+        n1 = edges[:, 1]
+        if not self.directed:
+            n0, n1 = np.minimum(n0, n1), np.maximum(n0, n1)
+        keys = n0 * self.nvert + n1
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        first = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        counts = np.diff(np.append(first, len(keys)))
+        occurrence = np.empty(len(keys), dtype=np.int64)
+        occurrence[order] = np.arange(len(keys)) - np.repeat(first, counts)
+        return occurrence * (self.nvert * self.nvert) + keys
+
+    # Sets the edges of the graph, and their weights if not None
+    def set_edges(self, edges, weights=None):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        keys = self.get_keys(edges)
+
+        removed = ~np.isin(self.keys, keys)
+        if removed.any():
+            self.graph.delete_edges(np.flatnonzero(removed).tolist())
+            self.edges = self.edges[~removed]
+            self.keys = self.keys[~removed]
+
+        added = ~np.isin(keys, self.keys)
+        if added.any():
+            self.graph.add_edges(edges[added].tolist())
+            self.edges = np.concatenate((self.edges, edges[added]))
+            self.keys = np.concatenate((self.keys, keys[added]))
+
+        if weights is not None:
+            order = np.argsort(keys)
+            self.weights = np.asarray(weights)[order[np.searchsorted(keys, self.keys, sorter=order)]]
+            self.graph.es["weight"] = self.weights.tolist()
+
+    # Sets the status of the vertices and their colors from the palette (see timeline.get_status_palette)
+    def set_status(self, status):
+        if self.status is None:
+            self.graph.vs["status"] = status.tolist()
+            self.graph.vs["color"] = self.palette[status].tolist()
+        else:
+            changed = np.flatnonzero(self.status != status)
+            if 0 < len(changed):
+                vs = self.graph.vs.select(changed.tolist())
+                vs["status"] = status[changed].tolist()
+                vs["color"] = self.palette[status[changed]].tolist()
+        self.status = status.copy()
+
+    def get_out_degrees(self):
+        return np.bincount(self.edges[:, 0], minlength=self.nvert)
+
+    def get_in_degrees(self):
+        return np.bincount(self.edges[:, 1], minlength=self.nvert)
+
+    def get_degrees(self):
+        return self.get_out_degrees() + self.get_in_degrees()
@@ -0,0 +1,216 @@
+import numpy as np
+
+from Bio.Phylo import BaseTree
+from Bio.Phylo.TreeConstruction import DistanceMatrix
+
+# Phylogenetic analysis of the sequences of a simulation. All the sequences come from the same
+# reference sequence through point mutations, so they are aligned by construction and they are
+# stored as the reference (an array of ASCII codes) plus a sparse diff for each sequence, a dict
+# from position to ASCII code.
+
+# Bases of the sequences at the variable positions (where some sequence differs from the reference),
+# as an (nseqs, npositions) uint8 array, and the array of positions
+def get_snp_matrix(ref_seq, diffs):
+    counts = [len(diff) for diff in diffs]
+    all_positions = np.fromiter((pos for diff in diffs for pos in diff.keys()), dtype=np.int64, count=sum(counts))
+    all_bases = np.fromiter((base for diff in diffs for base in diff.values()), dtype=np.uint8, count=sum(counts))
+
+    positions = np.unique(all_positions)
+    snps = np.tile(ref_seq[positions], (len(diffs), 1))
+    snps[np.repeat(np.arange(len(diffs)), counts), np.searchsorted(positions, all_positions)] = all_bases
+
+    # Positions that were mutated back to the reference base in all the sequences are not variable
+    variable = (snps != ref_seq[positions]).any(axis=0)
+    return snps[:, variable], positions[variable]
+
+# Number of positions where each pair of sequences differ, from the SNP matrix and the reference
+# bases at the same positions. With P the positions where a sequence differs from the reference,
+# the sequences i and j differ at |Pi| + |Pj| - |Pi & Pj| positions minus the positions where both
+# have the same alternate base, and both intersections are counted with a matrix product.
+def get_hamming_distances(snps, ref_bases):
+    alt = snps != ref_bases
+    rows, cols = np.nonzero(alt)
+    features, feature_cols = np.unique(cols * 256 + snps[rows, cols], return_inverse=True)
+    same_alt = np.zeros((len(snps), len(features)), dtype=np.float32)
+    same_alt[rows, feature_cols] = 1
+
+    alt = alt.astype(np.float32)
+    nalt = alt.sum(axis=1)
+    distances = nalt[:, None] + nalt[None, :] - alt @ alt.T - same_alt @ same_alt.T
+    return np.rint(distances).astype(np.int64)
+
+# Biopython DistanceMatrix with the same values as DistanceCalculator("identity") on the full
+# alignment (the fraction of positions where two sequences differ), computed from the SNP-only
+# alignment, the reference bases at the same positions and the length of the full sequences
+def get_snp_distance_matrix(names, snps, ref_bases, length):
+    identity = 1 - (length - get_hamming_distances(snps, ref_bases)) / length
+    return DistanceMatrix(list(names), [identity[i, :i + 1].tolist() for i in range(0, len(names))])
+
+# Same, computed from the diffs
+def get_distance_matrix(names, ref_seq, diffs):
+    snps, positions = get_snp_matrix(ref_seq, diffs)
+    return get_snp_distance_matrix(names, snps, ref_seq[positions], len(ref_seq))
+
+# Tree construction with the same results as the upgma and nj methods of Biopython's
+# DistanceTreeConstructor (same topology, branch lengths, inner node names and tie breaking), but
+# with the search for the closest pair of clusters and the distance updates vectorized.
+
+def get_full_matrix(dm):
+    n = len(dm)
+    full = np.zeros((n, n))
+    for i in range(0, n):
+        full[i, :i + 1] = dm.matrix[i]
+    return full + np.tril(full, -1).T
+
+# Closest cluster to cluster r among the active clusters before it, and the distance to it. Ties go
+# to the last one, as in Biopython.
+def get_closest_cluster(dist, active, r):
+    s = np.flatnonzero(active[:r])
+    if len(s) == 0:
+        return np.inf, -1
+    v = dist[r, s]
+    m = v.min()
+    return m, s[np.flatnonzero(v == m)[-1]]
+
+# Biopython's "upgma" joins the closest pair of clusters and sets the distance of the new cluster to
+# the average of the distances of the pair (so it is actually WPGMA). The clusters stay in the
+# rows of their first member and each row caches its closest cluster, which only needs to be looked
+# up again when that cluster is joined, so each step is O(n) instead of O(n^2).
+def build_upgma_tree(dm):
+    n = len(dm)
+    dist = get_full_matrix(dm)
+    clades = [BaseTree.Clade(None, name) for name in dm.names]
+    if n < 2:
+        return BaseTree.Tree(clades[0])
+    heights = np.zeros(n)
+    active = np.ones(n, dtype=bool)
+
+    lower = np.where(np.tri(n, k=-1, dtype=bool), dist, np.inf)
+    row_min = lower.min(axis=1)
+    row_arg = n - 1 - np.argmin(lower[:, ::-1], axis=1)
+    del lower
+
+    for inner_count in range(1, n):
+        min_dist = row_min.min()
+        i = np.flatnonzero(row_min == min_dist)[-1]
+        j = row_arg[i]
+
+        inner_clade = BaseTree.Clade(None, "Inner" + str(inner_count))
+        inner_clade.clades.append(clades[i])
+        inner_clade.clades.append(clades[j])
+        clades[i].branch_length = min_dist * 1.0 / 2 - heights[i]
+        clades[j].branch_length = min_dist * 1.0 / 2 - heights[j]
+        heights[j] = max(heights[i] + clades[i].branch_length, heights[j] + clades[j].branch_length)
+        clades[j] = inner_clade
+
+        active[i] = False
+        row_min[i] = np.inf
+        others = np.flatnonzero(active)
+        others = others[others != j]
+        dist[j, others] = (dist[i, others] + dist[j, others]) / 2
+        dist[others, j] = dist[j, others]
+
+        row_min[j], row_arg[j] = get_closest_cluster(dist, active, j)
+        rows = others[j < others]
+        v = dist[rows, j]
+        redo = (row_arg[rows] == i) | (row_arg[rows] == j)
+        closer = ~redo & ((v < row_min[rows]) | ((v == row_min[rows]) & (row_arg[rows] < j)))
+        row_min[rows[closer]] = v[closer]
+        row_arg[rows[closer]] = j
+        for r in rows[redo]:
+            row_min[r], row_arg[r] = get_closest_cluster(dist, active, r)
+
+    inner_clade.branch_length = 0
+    return BaseTree.Tree(inner_clade)
+
+# Neighbor joining as in Biopython. The clusters stay in the rows of their first member and the rows
+# of the joined clusters are zeroed and skipped, until half of them are unused and the matrix is
+# compacted. The sums of the rows are computed over the columns of the symmetric matrix, which adds
+# the rows one after the other, so they are exactly the same as Biopython's.
+def build_nj_tree(dm):
+    dist = get_full_matrix(dm)
+    clades = [BaseTree.Clade(None, name) for name in dm.names]
+    n = len(dist)
+    if n == 1:
+        return BaseTree.Tree(clades[0], rooted=False)
+    if n == 2:
+        clades[1].branch_length = dist[1, 0] / 2.0
+        clades[0].branch_length = dist[1, 0] - clades[1].branch_length
+        inner_clade = BaseTree.Clade(None, "Inner")
+        inner_clade.clades.append(clades[1])
+        inner_clade.clades.append(clades[0])
+        return BaseTree.Tree(inner_clade, rooted=False)
+
+    # Only the pairs (i, j) with j < i are searched, in blocks of rows against the columns before the
+    # end of the block, where the pairs with i <= j in the diagonal square are masked
+    block = 256
+    upper_inf = np.where(np.tri(block, k=-1, dtype=bool), 0.0, np.inf)
+    q = np.empty(block * n)
+    active = np.ones(n, dtype=bool)
+    m = n
+    inner_count = 0
+    while m > 2:
+        size = len(dist)
+        node_dist = dist.sum(axis=0) / (m - 2)
+        # The distances to the unused rows become +inf
+        node_dist[~active] = -np.inf
+        min_q = np.inf
+        for a in range(0, size, block):
+            b = min(a + block, size)
+            qb = q[:(b - a) * b].reshape(b - a, b)
+            np.subtract(dist[a:b, :b], node_dist[a:b, None], out=qb)
+            qb -= node_dist[None, :b]
+            qb[:, a:b] += upper_inf[:b - a, :b - a]
+            k = np.argmin(qb)
+            if qb.flat[k] < min_q:
+                min_q = qb.flat[k]
+                i, j = a + k // b, k % b
+        # Biopython starts the search with the pair (0, 1), the other pairs are (i, j) with j < i
+        first = np.flatnonzero(active)[:2]
+        if i == first[1] and j == first[0]:
+            i, j = j, i
+
+        inner_count += 1
+        inner_clade = BaseTree.Clade(None, "Inner" + str(inner_count))
+        inner_clade.clades.append(clades[i])
+        inner_clade.clades.append(clades[j])
+        clades[i].branch_length = (dist[i, j] + node_dist[i] - node_dist[j]) / 2.0
+        clades[j].branch_length = dist[i, j] - clades[i].branch_length
+        clades[j] = inner_clade
+        clades[i] = None
+
+        others = active.copy()
+        others[[i, j]] = False
+        dist[j, others] = (dist[i, others] + dist[j, others] - dist[i, j]) / 2.0
+        dist[others, j] = dist[j, others]
+        dist[i, :] = 0
+        dist[:, i] = 0
+        active[i] = False
+        m -= 1
+
+        if m <= size // 2:
+            rows = np.flatnonzero(active)
+            dist = dist[np.ix_(rows, rows)]
+            clades = [clades[k] for k in rows]
+            active = np.ones(m, dtype=bool)
+
+    rows = np.flatnonzero(active)
+    clades = [clades[k] for k in rows]
+    last_dist = dist[rows[1], rows[0]]
+    if clades[0] is inner_clade:
+        clades[0].branch_length = 0
+        clades[1].branch_length = last_dist
+        clades[0].clades.append(clades[1])
+        root = clades[0]
+    else:
+        clades[0].branch_length = last_dist
+        clades[1].branch_length = 0
+        clades[1].clades.append(clades[0])
+        root = clades[1]
+    return BaseTree.Tree(root, rooted=False)
+
+tree_methods = {"upgma": build_upgma_tree,
+                "nj": build_nj_tree}
+
+def build_tree(dm, method="upgma"):
+    return tree_methods[method](dm)
@@ -14,6 +14,16 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as clr
 
+from data_store import load_users, load_events, normalize_events, get_input_files
+from cache import DerivedCache
+from event_index import EventIndex
+import networks
+from networks import InfectionBuilder
+from timeline import get_num_steps, build_status_timeline, build_chart_timeline
+from rendering import render_jobs, MovieWriter
+from charts import ChartAnimator
+from segments import parse_render_args, get_movie_segments, merge_segments
+
 # Load properties
 if len(sys.argv) < 1:
     print("JSON files with simulation properties are missing")
@@ -23,6 +33,9 @@ json_fname = sys.argv[1]
 with open(json_fname) as f:
     props = json.load(f)
 
+# Options to render the movies in parts (see segments.py)
+render_options = parse_render_args(sys.argv[2:])
+
 title = props["title"]
 base_folder = props["base_folder"]
 sim_id = props["sim_id"]
@@ -40,6 +53,29 @@ if "use_new_id_schema" in props:
 else:
     use_new_id_schema = False
 
+if "use_cache" in props:
+    use_cache = props["use_cache"]
+else:
+    use_cache = True
+
+if "cache_max_mb" in props:
+    cache_max_mb = props["cache_max_mb"]
+else:
+    cache_max_mb = 2048
+
+# Number of processes rendering the frames, 0 uses all the cores
+if "render_workers" in props:
+    render_workers = props["render_workers"]
+else:
+    render_workers = 0
+
+# The frames are streamed to ffmpeg, every save_frames_every-th frame is also saved as a PNG image
+# for previews, 0 does not save any frames
+if "save_frames_every" in props:
+    save_frames_every = props["save_frames_every"]
+else:
+    save_frames_every = 0
+
 # Configuration
 
 # Coded status:
@@ -55,6 +91,7 @@ status_color = {0: clr.to_hex("cornflowerblue"),  # Susceptible
 data_folder = path.join(base_folder, "data")
 output_folder = path.join(base_folder, "output")
 movie_folder = path.join(output_folder, "movies")
+cache_folder = path.join(output_folder, "cache")
 if not path.exists(output_folder):
     os.makedirs(output_folder)
 output_sir_folder = path.join(base_folder, "output", "charts", "sir")
@@ -75,7 +112,9 @@ print_data_warnings = True
 # Default contact time for transmissions that are missing an associated contact event
 def_contact_time = 10
     
-frame_format = "png"
+# Size of the chart frames in pixels, figsize=(12,8) at 100 dpi
+frame_width = 1200
+frame_height = 800
 
 # Time delta for plots in seconds
 time_delta_sec = 60 * time_step_min
@@ -87,6 +126,11 @@ anim_steps_per_time_delta = 30
 # Number of ticks in the x axis of epi plots
 num_ticks = 10
 
+# Window scales (in number of time deltas) to calculate R effective, might need a scaling larger
+# than 1 to capture more events for an accurate estimation of Reff. The R effective plot uses scale.
+r_scales = [1, 5, 10]
+scale = 5
+
 # https://howchoo.com/g/ywi5m2vkodk/working-with-datetime-objects-and-timezones-in-python
 # https://itnext.io/working-with-timezone-and-python-using-pytz-library-4931e61e5152
 timezone = pytz.timezone(sim_tz)
@@ -101,149 +145,10 @@ else:
 # Some utility functions
 
 def get_contact_list(events, infections):
-    contacts = events[events["type"] == "contact"]
-
-    node0 = contacts.user_id.values
-    node1 = contacts.peer_id.values
-    length = contacts.contact_length.values
-
-    clist = {}
-    for id0, id1, l01 in zip(node0, node1, length):
-        n0 = user_index[id0]
-        if use_new_id_schema:
-            if id1 in user_index:
-                n1 = user_index[id1]
-            elif print_data_warnings:
-                print("Cannot find peer", id1)
-        else:
-            if id1 in p2pToId:
-                n1 = user_index[p2pToId[id1]]
-            elif print_data_warnings:
-                print("Cannot find peer", id1)
-    
-        if -1 < n1:
-            if n0 < n1:
-                p01 = (n0, n1)
-            else:
-                p01 = (n1, n0)
-            if p01 in clist:
-                c = clist[p01]
-            else: 
-                c = 0
-
-            clist[p01] = c + round(l01 / (60 * 1000))
-                        
-    # Adding contacts from transmissions if they are not registered as contacts already
-    for (n0, n1) in infections:
-        if n0 < n1:
-            p01 = (n0, n1)
-        else:
-            p01 = (n1, n0)
-        if not p01 in clist:
-            clist[p01] = def_contact_time
-            if print_data_warnings: print("Cannot find contact between", n0, "and", n1)            
-
-    return clist
-
-def get_infection_list(events):
-    infections = events[(events["type"] == "infection")]
-    
-    ilist = []
-    itimes = {}
-    infected = infections.user_id.values
-    peers = infections.inf.values
-    timestamp = infections.time.values
-    for id1, peer0, ts in zip(infected, peers, timestamp):
-        n1 = user_index[id1]
-            
-        if "PEER" in peer0:
-            if use_new_id_schema:
-                # New schema
-                id0 = int(peer0[peer0.index("[") + 1:peer0.index(":")])
-                if id0 in user_index:
-                    n0 = user_index[id0]                    
-                    add_infection = True
-                    for e in ilist:
-                        if e[1] == n1:
-                            pid0 = index_user[e[0]]
-                            ts0 = itimes[(pid0, id1)]
-                            if abs(ts - ts0) <= time_delta_sec:
-                                add_infection = False
-                                if pid0 == id0:                                
-                                    print("Duplicated infection:", id1, "was already infected by", id0, "in the last", time_step_min, "minutes")
-                                else:
-                                    print("Multiple infection:", id1, "is being infected by", id0, "but was already infected by", pid0, "in the last", time_step_min, "minutes")
-                                break    
-
-                    if add_infection: 
-                        ilist += [(n0, n1)]
-                        itimes[(id0, id1)] = ts
-                elif print_data_warnings:
-                    print("Cannot find peer", id0)                    
-            else:    
-                # Old schema (sims before 2022): p2p id is in the infection column
-                p2p0 = peer0[peer0.index("[") + 1:peer0.index(":")]
-                if p2p0 in p2pToId:
-                    id0 = p2pToId[p2p0]
-                    if id0 in user_index:
-                        n0 = user_index[id0]
-                        if not (n0, n1) in ilist:                        
-                            ilist += [(n0, n1)]
-                        elif print_data_warnings:
-                            print("Duplicated infection", id0, id1)  
-                elif print_data_warnings:
-                    print("Cannot find peer", p2p0)                        
-            
-    return ilist
-
-def get_node_status(events, status0 = None):    
-    if status0 == None:
-         status = [0] * len(users)
-    else:            
-        status = status0
-
-    inf = events[events["type"] == "infection"]
-    infMap = pd.Series(inf.inf.values, index=inf.user_id).to_dict()
-    for kid in infMap:
-        src = infMap[kid]
-        idx = user_index[kid]
-        if "CASE0" in src:
-            status[idx] = 1
-        if "PEER" in src:
-            status[idx] = 2
-            id0 = int(src[5:].split(":")[0])
-            idx0 = user_index[id0]       
-            if status[idx0] == 0:
-                status[idx0] = 1
-                if print_data_warnings:
-                    print("Infecting peer did not have correct status", idx0)
-
-    out = events[events["type"] == "outcome"]
-    outMap = pd.Series(out.out.values, index=out.user_id).to_dict()
-    for kid in outMap:
-        out = outMap[kid]
-        idx = user_index[kid]
-        if out == "DEAD":
-            status[idx] = 3
-        if out == "RECOVERED":
-            status[idx] = 4
-        if out == "VACCINATED":
-            status[idx] = 5
-    
-    return status
-
-def get_infection_network(infections, status):
-    nvert = len(user_index)
-    
-    g = Graph(directed=True)
-    g.add_vertices(nvert)
-    g.add_edges(infections)
+    return networks.get_contact_list(events, infections, len(user_index), def_contact_time, print_data_warnings)
 
-    if status:
-        g.vs["status"] = status
-        g.vs["color"] = [status_color[out] for out in g.vs["status"]]
-    
-    return g
+def new_infection_builder():
+    return InfectionBuilder(index_user, use_new_id_schema, time_delta_sec, print_data_warnings)
 
 # https://stackoverflow.com/a/48938464
 def hour_rounder(t):
@@ -253,17 +158,7 @@ def hour_rounder(t):
 
 # Load participants and histories
 
-all_users = pd.read_csv(path.join(data_folder, "participants.csv")) 
-all_events = pd.read_csv(path.join(data_folder, "histories.csv"))
-
-users = all_users[all_users["sim_id"] == sim_id]
-
-events = all_events[all_events["sim_id"] == sim_id]
-events.fillna({'contact_length':0, 'peer_id':-1}, inplace=True)
-events["event_start"] = events["time"] - events["contact_length"]/1000
-events["event_start"] = events["event_start"].astype(int, errors = 'ignore')
-if use_new_id_schema:
-    events["peer_id"] = events["peer_id"].astype(int, errors = 'ignore')
+users = load_users(data_folder, sim_id)
 
 p2pToSim = pd.Series(users.sim_id.values, index=users.p2p_id).to_dict()
 p2pToId = pd.Series(users.id.values, index=users.p2p_id).to_dict()
@@ -283,9 +178,31 @@ print(len(idTop2p))
 print(len(p2pToId))
 print(len(user_index))
 
+input_files = get_input_files(data_folder, "participants", sim_id) + get_input_files(data_folder, "histories", sim_id)
+cache = DerivedCache(cache_folder, props, input_files, cache_max_mb, use_cache)
+
+# The events are only loaded when some of the derived data is not in the cache
+events = None
+event_index = None
+
+def load_normalized_events():
+    events = load_events(data_folder, sim_id, use_new_id_schema)
+    return normalize_events(events, user_index, p2pToId, use_new_id_schema, print_data_warnings)
+
+def get_events():
+    global events, event_index
+    if events is None:
+        events = cache.get("events", load_normalized_events)
+        event_index = EventIndex(events)
+    return events
+
+def get_time_range():
+    events = get_events()
+    return min(events['time']), max(events['time'])
+
+min_time, max_time = cache.get("time_range", get_time_range)
+
 # Round min and max times to the hour
-min_time = min(events['time'])
-max_time = max(events['time'])
 first_date = hour_rounder(datetime.fromtimestamp(min_time, tz=timezone))
 last_date = hour_rounder(datetime.fromtimestamp(max_time, tz=timezone))
 min_time = datetime.timestamp(first_date)
@@ -302,11 +219,6 @@ print(first_date.tzinfo)
 
 # Animated charts
 
-frame = 0
-tframe = 0
-layout0 = None
-tstatus = None
-
 if obs_date0 and obs_date1:
     tmin = datetime.timestamp(obs_date0)
     tmax = datetime.timestamp(obs_date1)
@@ -322,239 +234,140 @@ label_spacing = int(num_points / num_ticks)
 
 nframes = int(((tmax - tmin) / time_delta_sec) * anim_steps_per_time_delta)
 
-series_susceptibles = []
-series_infected = []
-series_dead = []    
-series_recovered = []
-series_vaccinated = []
-series_contacts = []
-series_infections = []
-time_index = []
-time_ticks = []
-tlabels = []
+nsteps = get_num_steps(tmin, tmax, time_delta_sec)
+window_params = {"tmin": tmin, "tmax": tmax, "nsteps": nsteps}
 
-export_susceptibles = []
-export_infected = []
-export_dead = []    
-export_recovered = []
-export_vaccinated = []
-export_tlabels = []
+def get_status_timeline():
+    return build_status_timeline(get_events(), len(user_index), tmin, nsteps, time_delta_sec,
+                                 print_data_warnings=print_data_warnings)
+
+def get_chart_timeline():
+    get_events()
+    return build_chart_timeline(event_index, status_timeline, tmin, tmax, time_delta_sec,
+                                new_infection_builder, get_contact_list, r_scales)
 
-print("Calculating max number of infections and contacts...", end=" ")
-t = tmin
-nmaxinf = 0
-nmaxcont = 0
-while t <= tmax:
-    t0 = t    
-    t += time_delta_sec
-    condition = ((t0 < events['event_start']) & (events['event_start'] <= t)) | ((t0 < events['time']) & (events['time'] <= t))
-    tevents = events[condition]
-    tinfections = get_infection_list(tevents)
-    tcontacts = get_contact_list(tevents, tinfections)
-    nmaxinf = max(nmaxinf, len(tinfections))
-    nmaxcont = max(nmaxcont, len(tcontacts))    
+print("Calculating the timeline of infections and contacts...")
+status_timeline = cache.get("status_timeline", get_status_timeline, window_params)
+chart_timeline, r_timelines = cache.get("chart_timeline", get_chart_timeline,
+                                        dict(window_params, def_contact_time=def_contact_time, r_scales=r_scales))
+nmaxinf = chart_timeline["infections"].max()
+nmaxcont = chart_timeline["contacts"].max()
 print("Done")
 
-print("CREATING FRAMES...")
-print("FRAME", end =" ")
-t = tmin
-while t <= tmax:
-    t0 = t
-    t += time_delta_sec
-    td = datetime.fromtimestamp(t, tz=timezone)
-        
-    # We want to include contact and infection events that either started or ended between t0 and t
-    condition = ((t0 < events['event_start']) & (events['event_start'] <= t)) | ((t0 < events['time']) & (events['time'] <= t))
-    
-    tevents = events[condition]
-    tstatus = get_node_status(tevents, tstatus)
-    tinfections = get_infection_list(tevents)
-    tcontacts = get_contact_list(tevents, tinfections)
-    
-    nsusceptibles = 0
-    ninfected = 0
-    ndead = 0    
-    nrecovered = 0
-    nvaccinated = 0    
-    for k in range(0, len(tstatus)):
-        if tstatus[k] == 0:
-            nsusceptibles += 1
-        elif tstatus[k] == 1 or tstatus[k] == 2:
-            ninfected += 1  
-        elif tstatus[k] == 3:
-            ndead += 1
-        elif tstatus[k] == 4:
-            nrecovered += 1            
-        elif tstatus[k] == 5:
-            nvaccinated += 1
-
-    ninfections = len(tinfections)            
-    ncontacts = len(tcontacts)
-            
-    ntotal = nsusceptibles + ninfected + ndead + nrecovered + nvaccinated
-    # print(nsusceptibles, ninfected, ndead, nrecovered, nvaccinated, ntotal) 
+# Series of the animated charts, with one value per frame, and the time labels. A frame only shows
+# the labels of the time steps reached so far.
+time_index = np.arange(len(chart_timeline) * anim_steps_per_time_delta)
+series_susceptibles = np.repeat(chart_timeline["susceptible"].values, anim_steps_per_time_delta)
+series_infected = np.repeat(chart_timeline["infected"].values, anim_steps_per_time_delta)
+series_dead = np.repeat(chart_timeline["dead"].values, anim_steps_per_time_delta)
+series_recovered = np.repeat(chart_timeline["recovered"].values, anim_steps_per_time_delta)
+series_vaccinated = np.repeat(chart_timeline["vaccinated"].values, anim_steps_per_time_delta)
+series_contacts = np.repeat(chart_timeline["contacts"].values, anim_steps_per_time_delta)
+series_infections = np.repeat(chart_timeline["infections"].values, anim_steps_per_time_delta)
+series_total = series_susceptibles + series_infected + series_dead + series_recovered + series_vaccinated
 
+time_ticks = []
+tlabels = []
+export_tlabels = []
+for tframe, t in enumerate(chart_timeline["time"]):
+    td = datetime.fromtimestamp(t, tz=timezone)
     if tframe % label_spacing == 0:
         tlabels += [td.strftime('%b %d %-I:%M %p')]
-        time_ticks += [frame]
-    tframe += 1
-    
-    export_susceptibles.append(nsusceptibles)
-    export_infected.append(ninfected)
-    export_dead.append(ndead)
-    export_recovered.append(nrecovered)
-    export_vaccinated.append(nvaccinated)    
+        time_ticks += [tframe * anim_steps_per_time_delta]
     export_tlabels += [td.strftime("%m/%d/%Y %H:%M")]
-        
-    for i in range(0, anim_steps_per_time_delta):
-        print(frame, end =" ")
-        series_susceptibles.append(nsusceptibles)
-        series_infected.append(ninfected)
-        series_dead.append(ndead)
-        series_recovered.append(nrecovered)
-        series_vaccinated.append(nvaccinated)
-        series_contacts.append(ncontacts)
-        series_infections.append(ninfections)        
-    
-        time_index.append(frame)
-
-        # SIR plot
-        fig, ax = plt.subplots(figsize=(12,8), facecolor="white")
-        plt.ylim([-5, ntotal + 10])
-        plt.xlim([-5, nframes + 10])        
-        plt.xlabel("Time", labelpad=15, fontsize=15)
-        plt.ylabel("Participants", labelpad=15, fontsize=15)
-        ax.plot(time_index, series_susceptibles, label="Susceptible", color=status_color[0], lw=2)
-        ax.plot(time_index, series_infected, label="Infected", color=status_color[1], lw=2)
-        ax.plot(time_index, series_recovered, label="Recovered", color=status_color[4], lw=2)
-        ax.plot(time_index, series_vaccinated, label="Vaccinated", color=status_color[5], lw=2)        
-        ax.plot(time_index, series_dead, label="Dead", color=status_color[3], lw=2)
-        plt.axvline(x=frame, color="dimgray", lw=1)
-        plt.xticks(time_ticks, tlabels, rotation=45, horizontalalignment="right")
-        plt.legend(loc='upper right')
-        plt.tight_layout()
-        img_title = td.strftime('%B %d, %I:%M %p')
-        img_fn = "frame-" + str(frame) + "." + frame_format
-        fig.savefig(os.path.join(output_sir_folder, img_fn))
-        plt.close('all')
-        
-        # Contacts plot
-        fig, ax = plt.subplots(figsize=(12,8), facecolor="white")
-        plt.ylim([-5, nmaxcont + 10])
-        plt.xlim([-5, nframes + 10])        
-        plt.xlabel("Time", labelpad=15, fontsize=15)
-        plt.ylabel("Number of contacts", labelpad=15, fontsize=15)
-        ax.plot(time_index, series_contacts, color="black", lw=2)
-        plt.axvline(x=frame, color="dimgray", lw=1)
-        plt.xticks(time_ticks, tlabels, rotation=45, horizontalalignment="right")
-        plt.tight_layout()
-        img_title = td.strftime('%B %d, %I:%M %p')
-        img_fn = "frame-" + str(frame) + "." + frame_format
-        fig.savefig(os.path.join(output_cont_folder, img_fn))
-        plt.close('all')
-        
-        # Infections plot
-        fig, ax = plt.subplots(figsize=(12,8), facecolor="white")
-        plt.ylim([-5, nmaxinf + 10])
-        plt.xlim([-5, nframes + 10])        
-        plt.xlabel("Time", labelpad=15, fontsize=15)
-        plt.ylabel("Number of infections", labelpad=15, fontsize=15)
-        ax.plot(time_index, series_infections, color=status_color[1], lw=2)
-        plt.axvline(x=frame, color="dimgray", lw=1)
-        plt.xticks(time_ticks, tlabels, rotation=45, horizontalalignment="right")
-        plt.tight_layout()
-        img_title = td.strftime('%B %d, %I:%M %p')
-        img_fn = "frame-" + str(frame) + "." + frame_format
-        fig.savefig(os.path.join(output_inf_folder, img_fn))
-        plt.close('all') 
-
-        frame += 1
-
-print("\nDONE")
+time_ticks = np.array(time_ticks)
+
+# The charts are built once in each rendering process and only updated on each frame
+# (see charts.py), the frames only depend on the series above so they are rendered in parallel
+# (see rendering.py)
+animators = None
+
+def get_animators():
+    global animators
+    if animators is None:
+        xlim = [-5, nframes + 10]
+        sir_chart = ChartAnimator(time_index, [(series_susceptibles, "Susceptible", status_color[0]),
+                                               (series_infected, "Infected", status_color[1]),
+                                               (series_recovered, "Recovered", status_color[4]),
+                                               (series_vaccinated, "Vaccinated", status_color[5]),
+                                               (series_dead, "Dead", status_color[3])],
+                                  time_ticks, tlabels, xlim, [-5, series_total.max() + 10], "Participants", legend=True)
+        cont_chart = ChartAnimator(time_index, [(series_contacts, None, "black")],
+                                   time_ticks, tlabels, xlim, [-5, nmaxcont + 10], "Number of contacts")
+        inf_chart = ChartAnimator(time_index, [(series_infections, None, status_color[1])],
+                                  time_ticks, tlabels, xlim, [-5, nmaxinf + 10], "Number of infections")
+        animators = (sir_chart, cont_chart, inf_chart)
+    return animators
+
+def render_frame(frame):
+    sir_chart, cont_chart, inf_chart = get_animators()
+    return frame, sir_chart.render(frame), cont_chart.render(frame), inf_chart.render(frame)
 
-# Saving data file
-df = pd.DataFrame({"Time": export_tlabels,                    
-                   "Susceptible": export_susceptibles, "Infected": export_infected, "Dead": export_dead, "Recovered": export_recovered, "Vaccinated": export_vaccinated})
-df.to_excel(os.path.join(output_folder, "epi-data.xlsx"), index=False)
-
-print("CREATING THE MOVIE FILES...")
-
-def make_movie(in_folder, out_folder, fn):
-    movie_fn = path.join(out_folder, fn)
-    if path.exists(movie_fn):
-        os.remove(movie_fn)
-    cmd_str = "ffmpeg -i " + in_folder + "/frame-%d.png -c:v libx264 -pix_fmt yuv420p " + out_folder + "/" + fn
-    os.system(cmd_str)
+print("CREATING FRAMES...")
+movie_fns = [path.join(movie_folder, "counts-sir.mp4"), path.join(movie_folder, "counts-cont.mp4"),
+             path.join(movie_folder, "counts-inf.mp4")]
+png_folders = [output_sir_folder, output_cont_folder, output_inf_folder]
+total_frames = len(time_index)
+if render_options.merge:
+    for movie_fn in movie_fns:
+        merge_segments(movie_fn, total_frames)
+else:
+    # The segments that are missing in any of the movies, with the file name of the segment in each
+    # movie or None if it does not need to be rendered
+    segments = {}
+    for k, movie_fn in enumerate(movie_fns):
+        for start, end, fn in get_movie_segments(movie_fn, total_frames, render_options):
+            if (start, end) not in segments:
+                segments[(start, end)] = [None] * len(movie_fns)
+            segments[(start, end)][k] = fn
+
+    for (start, end), fns in sorted(segments.items()):
+        movies = []
+        for fn, png_folder in zip(fns, png_folders):
+            if fn:
+                movies += [MovieWriter(fn, frame_width, frame_height, png_folder=png_folder, png_every=save_frames_every)]
+            else:
+                movies += [None]
 
-make_movie(output_sir_folder, movie_folder, "counts-sir.mp4")
-make_movie(output_cont_folder, movie_folder, "counts-cont.mp4")
-make_movie(output_inf_folder, movie_folder, "counts-inf.mp4")
+        print("FRAME", end =" ")
+        for frame, sir_rgb, cont_rgb, inf_rgb in render_jobs(render_frame, range(start, end), render_workers):
+            print(frame, end =" ", flush=True)
+            for movie, rgb in zip(movies, [sir_rgb, cont_rgb, inf_rgb]):
+                if movie: movie.write(frame, rgb)
+        for movie in movies:
+            if movie: movie.close()
+        print()
 
 print("DONE")
 
+# Saving data file
+df = pd.DataFrame({"Time": export_tlabels,                    
+                   "Susceptible": chart_timeline["susceptible"], "Infected": chart_timeline["infected"], "Dead": chart_timeline["dead"],
+                   "Recovered": chart_timeline["recovered"], "Vaccinated": chart_timeline["vaccinated"]})
+df.to_excel(os.path.join(output_folder, "epi-data.xlsx"), index=False)
+
 # R effective over time
 
-# Might need a scaling larger than 1 to capture more events for an accurate estimation of Reff
-scale = 5
+with pd.ExcelWriter(os.path.join(output_folder, "r-effective.xlsx")) as writer:
+    for k in r_scales:
+        df = pd.DataFrame({"Time": [datetime.fromtimestamp(t, tz=timezone).strftime("%m/%d/%Y %H:%M") for t in r_timelines[k]["time"]],
+                           "R mean": r_timelines[k]["r_mean"], "R std": r_timelines[k]["r_std"]})
+        df.to_excel(writer, sheet_name="Scale " + str(k), index=False)
 
-delta = time_delta_sec * scale
 spacing = int(label_spacing / scale)
 
 frame = 0
-layout0 = None
-tstatus = None
-
-if obs_date0 and obs_date1:
-    tmin = datetime.timestamp(obs_date0)
-    tmax = datetime.timestamp(obs_date1)
-else:
-    tmin = min_time
-    tmax = max_time
-
-t = tmin
-r_mean_values = []
-r_std_values = []
 tlabels = []
 time_ticks = []
-index = []
-while t <= tmax:
-    t0 = t
-    t += delta
-    td = datetime.fromtimestamp(t, tz=timezone)    
-
-    # We want to include contact and infection events that either started or ended between t0 and t
-    condition = ((t0 < events['event_start']) & (events['event_start'] <= t)) | ((t0 < events['time']) & (events['time'] <= t))
-    
-    tevents = events[condition]
-    tstatus = get_node_status(tevents, tstatus)
-    tinfections = get_infection_list(tevents)
-    g = get_infection_network(tinfections, tstatus)
-    
-    # Getting all nodes with at least one edge
-    r_values = []    
-    sel = g.vs(_degree_gt=0)
-
-    for v in sel:
-        nout = v.degree(mode=OUT)
-        r_values += [nout]
-
-    if r_values:
-        r_mean = np.mean(r_values)
-        r_std = np.std(r_values)
-        r_mean_values += [r_mean]
-        r_std_values += [r_std]
-    else:
-        r_mean_values += [0]
-        r_std_values += [0]
-        
+for t in r_timelines[scale]["time"]:
+    td = datetime.fromtimestamp(t, tz=timezone)
     if frame % spacing == 0: 
         tlabels += [td.strftime('%b %d %-I:%M %p')]
         time_ticks += [frame]
-    time_index += [frame]
     frame += 1
 
-mu = np.array(r_mean_values)
-sigma = np.array(r_std_values)
+mu = r_timelines[scale]["r_mean"].values
+sigma = r_timelines[scale]["r_std"].values
 time = np.arange(len(sigma))
     
 fig, ax = plt.subplots(figsize=(12,8))
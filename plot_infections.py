@@ -5,7 +5,7 @@ import pytz
 
 from igraph import *
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageFont
 
 import seaborn as sns
 import numpy as np
@@ -14,6 +14,15 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as clr
 
+from data_store import load_users, load_events, normalize_events, get_input_files
+from cache import DerivedCache
+from event_index import EventIndex
+from networks import InfectionBuilder, TemporalGraph
+from layouts import calc_window_layouts, get_frame_layouts, get_pixel_layouts, get_frame_holds
+from timeline import get_num_steps, build_status_timeline, get_status_palette
+from rendering import render_jobs, get_surface_rgb, make_text_overlay, paint_overlay, MovieWriter
+from segments import parse_render_args, get_movie_segments, get_segment_runs, merge_segments
+
 # Load properties
 if len(sys.argv) < 1:
     print("JSON files with simulation properties are missing")
@@ -23,6 +32,9 @@ json_fname = sys.argv[1]
 with open(json_fname) as f:
     props = json.load(f)
 
+# Options to render the movie in parts (see segments.py)
+render_options = parse_render_args(sys.argv[2:])
+
 title = props["title"]
 base_folder = props["base_folder"]
 sim_id = props["sim_id"]
@@ -40,6 +52,29 @@ if "use_new_id_schema" in props:
 else:
     use_new_id_schema = False
 
+if "use_cache" in props:
+    use_cache = props["use_cache"]
+else:
+    use_cache = True
+
+if "cache_max_mb" in props:
+    cache_max_mb = props["cache_max_mb"]
+else:
+    cache_max_mb = 2048
+
+# Number of processes rendering the frames, 0 uses all the cores
+if "render_workers" in props:
+    render_workers = props["render_workers"]
+else:
+    render_workers = 0
+
+# The frames are streamed to ffmpeg, every save_frames_every-th frame is also saved as a PNG image
+# for previews, 0 does not save any frames
+if "save_frames_every" in props:
+    save_frames_every = props["save_frames_every"]
+else:
+    save_frames_every = 0
+
 # Configuration
 
 # Coded status:
@@ -51,6 +86,7 @@ status_color = {0: (1, 1, 1, 0),              # Susceptible (transparent)
                 4: clr.to_hex("mediumseagreen"),  # Recovered 
                 5: clr.to_hex("darkorchid")       # Vaccinated                
                } 
+status_palette = get_status_palette(status_color)
 
 # https://github.com/google/fonts/tree/master/apache
 label_font = ImageFont.truetype("Roboto-Regular.ttf", size=24)
@@ -71,6 +107,7 @@ data_folder = path.join(base_folder, "data")
 output_root = path.join(base_folder, "output")
 output_folder = path.join(output_root, "infections")
 movie_folder = path.join(output_root, "movies")
+cache_folder = path.join(output_root, "cache")
 if not path.exists(output_folder):
     os.makedirs(output_folder)
 if not path.exists(movie_folder):
@@ -79,8 +116,6 @@ if not path.exists(movie_folder):
 # Print warning messages to the console when parsing data
 print_data_warnings = True
     
-frame_format = "png"
-
 # Time delta for plots in seconds
 time_delta_sec = 60 * time_step_min
 
@@ -91,6 +126,33 @@ time_delta_sec = 60 * time_step_min
 anim_steps_per_time_delta = 30
 fr_niter = 10
 
+# Layout mode: "incremental" runs the fr algorithm fr_niter iterations for each frame as described above,
+# "keyframe" runs it keyframe_niter iterations once per time delta, seeded with the previous keyframe, and
+# interpolates the anim_steps_per_time_delta frames in between using tween_easing ("linear" or "ease").
+# The keyframe start temperature lets the nodes move about as far as in the incremental mode.
+# The layout backend is "fr" (igraph) or "barnes_hut", faster above ~1500 participants (benchmark_layouts.py).
+layout_mode = "incremental"
+layout_backend = "fr"
+keyframe_niter = 50
+keyframe_start_temp = 0.3
+tween_easing = "ease"
+
+# If hold_static_layouts is true, the windows where the layout graph does not change keep the layout of
+# the previous window once it has converged (the last layout did not move any vertex more than
+# hold_tolerance_px pixels), and consecutive frames where no vertex moves hold_tolerance_px pixels or more are
+# rendered once and held for the duration of the run.
+hold_static_layouts = True
+hold_tolerance_px = 0.1
+
+# Seed of the layout algorithm, so the layouts are the same in every run
+layout_seed = 1
+
+# If active_layout is true, the layout algorithm only runs on the participants in the infection chains (that
+# had an edge in the last active_decay_windows time deltas), and the others stay parked where they were, so
+# the layout cost follows the number of infections instead of the population size.
+active_layout = False
+active_decay_windows = 4
+
 # https://howchoo.com/g/ywi5m2vkodk/working-with-datetime-objects-and-timezones-in-python
 # https://itnext.io/working-with-timezone-and-python-using-pytz-library-4931e61e5152
 timezone = pytz.timezone(sim_tz)
@@ -104,122 +166,15 @@ else:
 
     # Some utility functions
 
-def get_infection_list(events):
-    infections = events[(events["type"] == "infection")]
-    
-    ilist = []
-    itimes = {}
-    infected = infections.user_id.values
-    peers = infections.inf.values
-    timestamp = infections.time.values
-    for id1, peer0, ts in zip(infected, peers, timestamp):
-        n1 = user_index[id1]
-            
-        if "PEER" in peer0:
-            if use_new_id_schema:
-                # New schema
-                id0 = int(peer0[peer0.index("[") + 1:peer0.index(":")])
-                if id0 in user_index:
-                    n0 = user_index[id0]                    
-                    add_infection = True
-                    for e in ilist:
-                        if e[1] == n1:
-                            pid0 = index_user[e[0]]
-                            ts0 = itimes[(pid0, id1)]
-                            if abs(ts - ts0) <= time_delta_sec:
-                                add_infection = False
-                                if pid0 == id0:                                
-                                    print("Duplicated infection:", id1, "was already infected by", id0, "in the last", time_step_min, "minutes")
-                                else:
-                                    print("Multiple infection:", id1, "is being infected by", id0, "but was already infected by", pid0, "in the last", time_step_min, "minutes")
-                                break    
-
-                    if add_infection: 
-                        ilist += [(n0, n1)]
-                        itimes[(id0, id1)] = ts
-                elif print_data_warnings:
-                    print("Cannot find peer", id0)                    
-            else:    
-                # Old schema (sims before 2022): p2p id is in the infection column
-                p2p0 = peer0[peer0.index("[") + 1:peer0.index(":")]
-                if p2p0 in p2pToId:
-                    id0 = p2pToId[p2p0]
-                    if id0 in user_index:
-                        n0 = user_index[id0]
-                        if not (n0, n1) in ilist:                        
-                            ilist += [(n0, n1)]
-                        elif print_data_warnings:
-                            print("Duplicated infection", id0, id1)  
-                elif print_data_warnings:
-                    print("Cannot find peer", p2p0)                        
-            
-    return ilist    
-
-def get_node_status(events, status0 = None):
-    if status0 == None:
-         status = [0] * len(users)
-    else:            
-        status = status0
-
-    inf = events[events["type"] == "infection"]
-    infMap = pd.Series(inf.inf.values, index=inf.user_id).to_dict()
-    infTimes = pd.Series(inf.time.values, index=inf.user_id).to_dict()
-    for kid in infMap:
-        src = infMap[kid]
-        idx = user_index[kid]
-        if "CASE0" in src:
-            status[idx] = 1
-        if "PEER" in src:
-            status[idx] = 2
-            id0 = int(src[5:].split(":")[0])
-            idx0 = user_index[id0]
-            if status[idx0] == 0:
-                status[idx0] = 1
-                if print_data_warnings:
-                    print("Infecting peer did not have correct status", idx0)
-                    
-    out = events[events["type"] == "outcome"]
-    outMap = pd.Series(out.out.values, index=out.user_id).to_dict()
-    outTimes = pd.Series(out.time.values, index=out.user_id).to_dict()
-    for kid in outMap:
-        out = outMap[kid]
-        idx = user_index[kid]
-        if out == "DEAD":
-            status[idx] = 3
-        if out == "RECOVERED":
-            if not kid in infTimes or infTimes[kid] < outTimes[kid]:
-                status[idx] = 4
-            else:
-                print(kid, "became reinfected after recovery from infection")
-        if out == "VACCINATED":
-            status[idx] = 5
-    
-    return status
-
-def get_infection_network(infections, status):
-    nvert = len(user_index)
-    
-    g = Graph(directed=True)
-    g.add_vertices(nvert)
-    g.add_edges(infections)
+def plot_network(g, layout, title_overlay):
+    style["layout"] = layout
+    p = plot(g, None, **style)
+    p.redraw()
 
-    if status:
-        g.vs["status"] = status
-        g.vs["color"] = [status_color[out] for out in g.vs["status"]]
-    
-    return g
+    if title_overlay is not None:
+        paint_overlay(p.surface, title_overlay, 10, 760)
 
-def plot_network(g, layout, title, fn):
-    img_fn = os.path.join(output_folder, fn)
-    
-    style["layout"] = layout
-    p = plot(g, img_fn, **style)
-    
-    if ".png" in fn and title:
-        image = Image.open(img_fn)
-        draw = ImageDraw.Draw(image)
-        draw.text((10, 760), title, fill='rgb(0, 0, 0)', font=label_font)
-        image.save(img_fn)
+    return get_surface_rgb(p.surface)
 
 # https://stackoverflow.com/a/48938464
 def hour_rounder(t):
@@ -229,15 +184,7 @@ def hour_rounder(t):
 
 # Load participants and histories
 
-all_users = pd.read_csv(path.join(data_folder, "participants.csv")) 
-all_events = pd.read_csv(path.join(data_folder, "histories.csv"))
-
-users = all_users[all_users["sim_id"] == sim_id]
-
-events = all_events[all_events["sim_id"] == sim_id]
-events.fillna({'contact_length':0, 'peer_id':-1}, inplace=True)
-events["event_start"] = events["time"] - events["contact_length"]/1000
-events["event_start"] = events["event_start"].astype(int)
+users = load_users(data_folder, sim_id)
 
 p2pToSim = pd.Series(users.sim_id.values, index=users.p2p_id).to_dict()
 p2pToId = pd.Series(users.id.values, index=users.p2p_id).to_dict()
@@ -257,9 +204,31 @@ print(len(idTop2p))
 print(len(p2pToId))
 print(len(user_index))
 
+input_files = get_input_files(data_folder, "participants", sim_id) + get_input_files(data_folder, "histories", sim_id)
+cache = DerivedCache(cache_folder, props, input_files, cache_max_mb, use_cache)
+
+# The events are only loaded when some of the derived data is not in the cache
+events = None
+event_index = None
+
+def load_normalized_events():
+    events = load_events(data_folder, sim_id, use_new_id_schema)
+    return normalize_events(events, user_index, p2pToId, use_new_id_schema, print_data_warnings)
+
+def get_events():
+    global events, event_index
+    if events is None:
+        events = cache.get("events", load_normalized_events)
+        event_index = EventIndex(events)
+    return events
+
+def get_time_range():
+    events = get_events()
+    return min(events['time']), max(events['time'])
+
+min_time, max_time = cache.get("time_range", get_time_range)
+
 # Round min and max times to the hour
-min_time = min(events['time'])
-max_time = max(events['time'])
 first_date = hour_rounder(datetime.fromtimestamp(min_time, tz=timezone))
 last_date = hour_rounder(datetime.fromtimestamp(max_time, tz=timezone))
 min_time = datetime.timestamp(first_date)
@@ -276,16 +245,6 @@ print(first_date.tzinfo)
 
 # Infections over time
 
-print("CREATING FRAMES...") 
-
-# How to properly animate an igraph network over time (so nodes change position smoothly from frame to frame):
-# http://estebanmoro.org/post/2015-12-21-temporal-networks-with-r-and-igraph-updated/
-# https://github.com/emoro/temporal_networks
-
-frame = 0
-layout0 = None
-tstatus = None
-
 if obs_date0 and obs_date1:
     tmin = datetime.timestamp(obs_date0)
     tmax = datetime.timestamp(obs_date1)
@@ -293,42 +252,122 @@ else:
     tmin = min_time
     tmax = max_time
 
-t = tmin
-print("FRAME", end =" ")
-while t <= tmax:
-    t0 = t
-    t += time_delta_sec    
-    td = datetime.fromtimestamp(t, tz=timezone)    
+nsteps = get_num_steps(tmin, tmax, time_delta_sec)
+window_params = {"tmin": tmin, "nsteps": nsteps}
+
+# The status includes all the events up to each time step, not only the ones inside the window
+def get_status_timeline():
+    return build_status_timeline(get_events(), len(user_index), tmin, nsteps, time_delta_sec,
+                                 cumulative=True, print_data_warnings=print_data_warnings)
+
+# The transmission graph is built incrementally, adding the infections of each new window. Since
+# edges are only appended, the graph at each step is given by the number of edges at that step.
+def get_infection_timeline():
+    get_events()
+    infection_builder = InfectionBuilder(index_user, use_new_id_schema, time_delta_sec, print_data_warnings)
+    infection_builder.add(event_index.until(tmin))
+    counts = []
+    for step in range(0, nsteps):
+        t0 = tmin + step * time_delta_sec
+        t = t0 + time_delta_sec
+        infection_builder.add(event_index.ended(t0, t))
+        counts += [len(infection_builder.edges)]
+    return infection_builder.edges, counts
+
+status_timeline = cache.get("status_timeline", get_status_timeline, dict(window_params, cumulative=True))
+all_infections, infection_counts = cache.get("infection_timeline", get_infection_timeline, window_params)
 
-    condition = events['time'] <= t
-    
-    tevents = events[condition]
-    tstatus = get_node_status(tevents, tstatus)
-    infections = get_infection_list(tevents)
-    g = get_infection_network(infections, tstatus)
-    
-    for i in range(0, anim_steps_per_time_delta):
-        print(frame, end =" ")
-        
-        # https://igraph.org/python/api/latest/igraph._igraph.GraphBase.html#layout_fruchterman_reingold        
-        layout = g.layout_fruchterman_reingold(niter=fr_niter, start_temp=0.05, grid='nogrid', seed=layout0)
-        layout0 = layout.copy()
-        
-        img_title = td.strftime('%B %d, %I:%M %p')
-        img_fn =  "frame-" + str(frame) + "." + frame_format
-        plot_network(g, layout, img_title, img_fn)
-
-        frame += 1
-
-print("\nDONE")
+# How to properly animate an igraph network over time (so nodes change position smoothly from frame to frame):
+# http://estebanmoro.org/post/2015-12-21-temporal-networks-with-r-and-igraph-updated/
+# https://github.com/emoro/temporal_networks
 
-print("CREATING THE MOVIE FILE...")
+if layout_mode == "keyframe":
+    layout_params = {"layout_mode": layout_mode, "niter": keyframe_niter, "start_temp": keyframe_start_temp}
+else:
+    layout_params = {"layout_mode": layout_mode, "niter": fr_niter, "start_temp": 0.05,
+                     "anim_steps_per_time_delta": anim_steps_per_time_delta}
+layout_params["hold_static"] = hold_static_layouts
+layout_params["hold_tolerance_px"] = hold_tolerance_px
+layout_params["seed"] = layout_seed
+layout_params["backend"] = layout_backend
+layout_params["active_decay"] = active_decay_windows if active_layout else 0
+
+# The infection network grows over time, so the graphs are updated in place by adding the new edges
+# of each time window (see networks.TemporalGraph)
+layout_graph = TemporalGraph(len(user_index), True)
+
+def get_layout_graph(step):
+    layout_graph.set_edges(all_infections[:infection_counts[step]])
+    return layout_graph.graph, None
+
+def get_layouts():
+    print("CALCULATING LAYOUTS...")
+    return calc_window_layouts(get_layout_graph, nsteps, len(user_index), layout_mode, anim_steps_per_time_delta,
+                               layout_params["niter"], layout_params["start_temp"], hold_static_layouts, layout_seed,
+                               layout_backend, layout_params["active_decay"], hold_tolerance_px,
+                               (style["bbox"][0] - 2 * style["margin"], style["bbox"][1] - 2 * style["margin"]))
+
+layouts = cache.get("infection_layouts", get_layouts, dict(window_params, **layout_params))
 
-movie_fn = path.join(output_folder, "movie.mp4")
-if path.exists(movie_fn):
-    os.remove(movie_fn)
+print("CREATING FRAMES...") 
 
-cmd_str = "ffmpeg -i " + output_folder + "/frame-%d.png -c:v libx264 -pix_fmt yuv420p " + movie_folder + "/infect-net.mp4"
-os.system(cmd_str)
+# Graph, title overlay and frame layouts of the time window being rendered by this process
+window = None
+render_graph = TemporalGraph(len(user_index), True, status_palette)
+
+def get_window(step):
+    global window
+    if window is None or window[0] != step:
+        t = tmin + (step + 1) * time_delta_sec
+        td = datetime.fromtimestamp(t, tz=timezone)    
+
+        tstatus = status_timeline[step]
+        render_graph.set_edges(all_infections[:infection_counts[step]])
+        render_graph.set_status(tstatus)
+        g = render_graph.graph
+        frame_layouts = get_frame_layouts(layouts, step, layout_mode, anim_steps_per_time_delta, tween_easing)
+        img_title = td.strftime('%B %d, %I:%M %p')
+        title_overlay = make_text_overlay(img_title, label_font)
+        window = (step, g, title_overlay, frame_layouts)
+    return window
+
+# Frames to render and how many frames each one is held for, the frames that look the same as the
+# previous one in the window are not rendered again
+def get_frame_runs():
+    width = style["bbox"][0] - 2 * style["margin"]
+    height = style["bbox"][1] - 2 * style["margin"]
+    runs = []
+    for step in range(0, nsteps):
+        frame_layouts = get_frame_layouts(layouts, step, layout_mode, anim_steps_per_time_delta, tween_easing)
+        holds = get_frame_holds(get_pixel_layouts(frame_layouts, width, height), hold_tolerance_px)
+        for i in np.flatnonzero(holds):
+            runs += [(int(step * anim_steps_per_time_delta + i), int(holds[i]))]
+    return runs
+
+# Renders a frame, the layouts are already computed so the frames are rendered in parallel
+# (see rendering.py)
+def render_frame(run):
+    frame, out_frame, hold = run
+    step, g, title_overlay, frame_layouts = get_window(frame // anim_steps_per_time_delta)
+    layout = Layout(frame_layouts[frame % anim_steps_per_time_delta].tolist())
+    return out_frame, hold, plot_network(g, layout, title_overlay)
+
+nframes = nsteps * anim_steps_per_time_delta
+movie_fn = path.join(movie_folder, "infect-net.mp4")
+if render_options.merge:
+    merge_segments(movie_fn, nframes)
+else:
+    frame_runs = get_frame_runs()
+    for start, end, fn in get_movie_segments(movie_fn, nframes, render_options):
+        runs = get_segment_runs(frame_runs, start, end)
+        print("Rendering", len(runs), "of", end - start, "frames to", path.basename(fn))
+
+        movie = MovieWriter(fn, style["bbox"][0], style["bbox"][1], png_folder=output_folder, png_every=save_frames_every)
+        print("FRAME", end =" ")
+        for frame, hold, rgb in render_jobs(render_frame, runs, render_workers):
+            print(frame, end =" ", flush=True)
+            movie.write(frame, rgb, hold)
+        movie.close()
+        print()
 
 print("DONE")
\ No newline at end of file
@@ -5,18 +5,21 @@ from igraph import *
 
 from PIL import Image, ImageDraw, ImageFont
 
+import numpy as np
 import pandas as pd
 import json
 
 from Bio import Phylo
 from Bio.Phylo.TreeConstruction import DistanceCalculator
-from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
 from Bio import AlignIO
 
-import matplotlib
-import matplotlib.pyplot as plt
 import matplotlib.colors as clr
 
+from data_store import load_table, load_users
+from phylo import get_snp_matrix, get_snp_distance_matrix, build_tree
+from tree_drawing import draw_tree
+from sequence_files import get_sequence_fn, open_sequence_file, write_fasta, write_phylip, get_snp_records, write_vcf
+
 # Load properties
 if len(sys.argv) < 1:
     print("JSON files with simulation properties are missing")
@@ -44,6 +47,32 @@ if "use_new_id_schema" in props:
 else:
     use_new_id_schema = False
 
+# Method used to build the phylogenetic tree from the distances, "upgma" or "nj" (neighbor joining)
+if "tree_method" in props:
+    tree_method = props["tree_method"]
+else:
+    tree_method = "upgma"
+
+# Clades whose sequences are all within this distance of the clade are drawn collapsed into a wedge,
+# none are collapsed by default
+if "tree_collapse_distance" in props:
+    tree_collapse_distance = props["tree_collapse_distance"]
+else:
+    tree_collapse_distance = None
+
+# The SNP-only alignment (snps.fasta) and the table of variable positions (snps.vcf) are always
+# saved, the full sequences (sequences.fasta and msa.phy) can be skipped for large simulations
+if "save_full_sequences" in props:
+    save_full_sequences = props["save_full_sequences"]
+else:
+    save_full_sequences = True
+
+# Compression of the sequence files: "none", "gzip" or "bgzip"
+if "sequence_compression" in props:
+    sequence_compression = props["sequence_compression"]
+else:
+    sequence_compression = "none"
+
 # Configuration
 
 data_folder = path.join(base_folder, "data")
@@ -63,104 +92,145 @@ style["edge_curved"] = False
 
 label_font = ImageFont.truetype("Roboto-Regular.ttf", size=24)
 
-# Load the data
+# Distances between the sequences for the phylogenetic tree: "snp" computes them from the positions
+# where the sequences differ from the reference (see phylo.py), "biopython" reads the MSA file back
+# and uses Biopython's DistanceCalculator, which gives the same distances but is much slower (and
+# needs the full sequences to be saved).
+distance_backend = "snp"
 
-all_users = pd.read_csv(path.join(data_folder, "participants.csv"))
-all_sequences = pd.read_csv(path.join(data_folder, "sequences.csv"))
-all_mutations = pd.read_csv(path.join(data_folder, "mutations.csv"))
+# Load the data
 
-users = all_users[all_users["sim_id"] == sim_id]
-ref_seq = list(all_sequences[all_sequences["pathogen_id"] == pathogen_id]["sequence"].values[0])
-mutations = all_mutations[all_mutations["sim_id"] == sim_id]
-mutations = mutations.assign(sequence='')
+users = load_users(data_folder, sim_id)
+ref_seq = np.frombuffer(load_table(data_folder, "sequences", pathogen_id)["sequence"].values[0].encode("ascii"), dtype=np.uint8)
+mutations = load_table(data_folder, "mutations", sim_id)
 mutations.sort_values(by=['id'], inplace=True)
 
-#print(''.join(ref_seq))
+#print(ref_seq.tobytes().decode("ascii"))
 #print(mutations)
 
 # Save all the recorded sequences
 
-def apply_delta(seq, delta):
+# The sequences are stored as the reference sequence, an array of ASCII codes, plus the sparse diff
+# of each sequence from the reference, a dict from position to ASCII code that is inherited from the
+# parent sequence, and the full sequences are only built when they are written out.
+
+def apply_delta(diff, delta):
     for k in delta.keys():
         pos = int(k)
         nt0, nt1 = delta[k].split('-')
-        seq[pos] = nt1
+        diff[pos] = ord(nt1)
+
+def get_sequence(diff):
+    seq = ref_seq.copy()
+    if diff:
+        seq[list(diff.keys())] = list(diff.values())
+    return seq.tobytes().decode("ascii")
 
-def add_sequence(id, pid, seq, lines):
+def add_sequence(id, pid, diff, records):
     if id == 0:
-        lines += [">seq" + str(pathogen_id if pid == 0 else pid)]
+        records += [(">seq" + str(pathogen_id if pid == 0 else pid), diff)]
     else:
-        lines += [">seq" + str(pathogen_id if pid == 0 else pid) + "-" + str(id)]
-    lines += [''.join(seq)]
+        records += [(">seq" + str(pathogen_id if pid == 0 else pid) + "-" + str(id), diff)]
 
-def get_prev_seq(p_mut_id, transmissions, fasta_lines):
-    if p_mut_id == 0:
-        return ref_seq.copy()
-    else:
-        prev_mutation = mutations[mutations["id"] == p_mut_id]
-        prev_seq = list(prev_mutation["sequence"].values[0])
-        if prev_seq:
-            return prev_seq
-        else:
-            if prev_mutation["id"].values[0] != p_mut_id:
-                print("Error, inconsistent mutation ID for", p_mut_id)
-                return []
-            pp_mut_id = prev_mutation["prev_mutation_id"].values[0]
-            prev_seq = get_prev_seq(pp_mut_id, transmissions, fasta_lines)
-            if not prev_seq: return []
-            apply_delta(prev_seq, json.loads(prev_mutation["delta"].values[0]))
-            prev_mutation["sequence"].values[0] = prev_seq
-            add_seq = True
-            if pathogen_id < pp_mut_id:
-                t = (pp_mut_id - pathogen_id - 1, p_mut_id - pathogen_id - 1)
-                if not t in transmissions:
-                    transmissions += [t]
-                else:
-                    print("Warning: duplicated transmission", str(pp_mut_id) + "-" + str(p_mut_id))
-                    add_seq = False
-            if add_seq: add_sequence(p_mut_id, pp_mut_id, prev_seq, fasta_lines)
-            return prev_seq.copy()
+# The mutations are indexed by id, and the sequence of each mutation is resolved only once, by
+# applying its delta to the diff of the previous mutation (or to an empty diff if the previous id
+# is 0). The chain of unresolved ancestors is walked iteratively, so long transmission
+# chains do not reach the recursion limit, and then resolved from the oldest ancestor down, adding
+# each sequence after the sequence of its parent.
+
+mutation_ids = mutations["id"].values.tolist()
+prev_mutation_ids = mutations["prev_mutation_id"].values.tolist()
+deltas = mutations["delta"].values.tolist()
 
+mutation_index = {}
+for i, mut_id in enumerate(mutation_ids):
+    if mut_id not in mutation_index:
+        mutation_index[mut_id] = i
+
+diffs = [None] * len(mutations)
 transmissions = []
-fasta_lines = []
-
-for idx in mutations.index:
-    mut_id = mutations["id"][idx]
-    p_mut_id = mutations["prev_mutation_id"][idx]
-    seq = mutations["sequence"][idx]
-    if seq: continue
-    prev_seq = get_prev_seq(p_mut_id, transmissions, fasta_lines)
-    if not prev_seq: 
-        print("Error, cannot resolve sequence for mutation", p_mut_id)
-        continue
-    apply_delta(prev_seq, json.loads(mutations["delta"][idx]))
-    mutations.at[idx, "sequence"] = prev_seq
-    add_seq = True
+transmission_set = set()
+# Name and diff of the sequences to save, in order
+sequence_records = []
+
+def add_resolved_sequence(i):
+    mut_id = mutation_ids[i]
+    p_mut_id = prev_mutation_ids[i]
     if pathogen_id < p_mut_id:
         t = (p_mut_id - pathogen_id - 1, mut_id - pathogen_id - 1)
-        if not t in transmissions:
-            transmissions += [t]
-        else:
+        if t in transmission_set:
             print("Warning: duplicated transmission", str(p_mut_id) + "-" + str(mut_id))
-            add_seq = False
-    if add_seq: add_sequence(mut_id, p_mut_id, prev_seq, fasta_lines)
-
-print("Saving FASTA file")
-fasta_fn = path.join(output_folder, "sequences.fasta")
-with open(fasta_fn, 'w') as f:
-    for line in fasta_lines:
-        f.write(line + '\n')
-
-print("Saving MSA file")
-# All sequences from the sim align perfectly since they only differ in point mutations
-# from one another.
-phy_fn = path.join(output_folder, "msa.phy")
-with open(phy_fn, 'w') as f:
-    f.write(str(int(len(fasta_lines)/2)) + " " + str(len(ref_seq)) + '\n')
-    for i in range(1, len(fasta_lines), 2):
-        name = fasta_lines[i - 1]
-        seq = fasta_lines[i]
-        f.write(name[4:].ljust(10) + seq + '\n')
+            return
+        transmissions.append(t)
+        transmission_set.add(t)
+    add_sequence(mut_id, p_mut_id, diffs[i], sequence_records)
+
+def resolve_sequence(i):
+    # Unresolved ancestors of the mutation, starting with the mutation itself
+    chain = []
+    chain_set = set()
+    k = i
+    while diffs[k] is None:
+        if k in chain_set:
+            print("Error, circular mutation chain for mutation", mutation_ids[i])
+            return None
+        chain.append(k)
+        chain_set.add(k)
+        p_mut_id = prev_mutation_ids[k]
+        if p_mut_id == 0:
+            break
+        if p_mut_id not in mutation_index:
+            print("Error, cannot resolve sequence for mutation", p_mut_id)
+            return None
+        k = mutation_index[p_mut_id]
+
+    for k in reversed(chain):
+        p_mut_id = prev_mutation_ids[k]
+        if p_mut_id == 0:
+            diff = {}
+        else:
+            diff = diffs[mutation_index[p_mut_id]].copy()
+        apply_delta(diff, json.loads(deltas[k]))
+        diffs[k] = diff
+        add_resolved_sequence(k)
+    return diffs[i]
+
+# Resolves the sequences of all the mutations, yielding the new records as they are added
+def resolve_sequences():
+    for i in range(0, len(mutations)):
+        start = len(sequence_records)
+        resolve_sequence(i)
+        for record in sequence_records[start:]:
+            yield record
+
+# The full sequences are built one at a time as they are written
+if save_full_sequences:
+    print("Saving FASTA file")
+    fasta_fn = get_sequence_fn(path.join(output_folder, "sequences.fasta"), sequence_compression)
+    with open_sequence_file(fasta_fn, "w", sequence_compression) as f:
+        write_fasta(f, ((name[1:], get_sequence(diff)) for name, diff in resolve_sequences()))
+
+    print("Saving MSA file")
+    # All sequences from the sim align perfectly since they only differ in point mutations
+    # from one another.
+    phy_fn = get_sequence_fn(path.join(output_folder, "msa.phy"), sequence_compression)
+    with open_sequence_file(phy_fn, "w", sequence_compression) as f:
+        write_phylip(f, ((name[4:], get_sequence(diff)) for name, diff in sequence_records),
+                     len(sequence_records), len(ref_seq))
+else:
+    for record in resolve_sequences():
+        pass
+
+print("Saving SNP alignment")
+sequence_names = [name[1:] for name, diff in sequence_records]
+snps, snp_positions = get_snp_matrix(ref_seq, [diff for name, diff in sequence_records])
+snp_fn = get_sequence_fn(path.join(output_folder, "snps.fasta"), sequence_compression)
+with open_sequence_file(snp_fn, "w", sequence_compression) as f:
+    write_fasta(f, get_snp_records(sequence_names, snps))
+
+vcf_fn = get_sequence_fn(path.join(output_folder, "snps.vcf"), sequence_compression)
+with open_sequence_file(vcf_fn, "w", sequence_compression) as f:
+    write_vcf(f, sequence_names, snps, snp_positions, ref_seq[snp_positions], "seq" + str(pathogen_id), len(ref_seq))
 
 # Create network of transmissions from sequence data
 
@@ -184,13 +254,17 @@ p = plot(g, img_fn, **style)
 
 print("Generating phylogenetic tree")
 
-aln = AlignIO.read(phy_fn, 'phylip')
-
-calculator = DistanceCalculator('identity')
-dm = calculator.get_distance(aln)
+if distance_backend == "biopython" and save_full_sequences:
+    with open_sequence_file(phy_fn, "r", sequence_compression) as f:
+        aln = AlignIO.read(f, 'phylip')
+    calculator = DistanceCalculator('identity')
+    dm = calculator.get_distance(aln)
+else:
+    # The SNP-only alignment has all the information needed for the distances
+    dm = get_snp_distance_matrix([name[4:] for name, diff in sequence_records], snps,
+                                 ref_seq[snp_positions], len(ref_seq))
 
-constructor = DistanceTreeConstructor()
-tree = constructor.upgma(dm)
+tree = build_tree(dm, tree_method)
 
 tree_fn = path.join(output_folder, "tree.dnd")
 Phylo.write(tree, tree_fn, "newick")
@@ -198,7 +272,4 @@ Phylo.write(tree, tree_fn, "newick")
 print("Saving tree image")
 img_fn = path.join(output_folder, "tree.pdf")
 
-matplotlib.rc('font', size=8)
-fig, ax = plt.subplots(figsize=(20, 70), dpi=100)
-Phylo.draw(tree, axes=ax, do_show=False)
-fig.savefig(img_fn, dpi=100)
\ No newline at end of file
+draw_tree(tree, img_fn, tree_collapse_distance)
\ No newline at end of file
@@ -0,0 +1,117 @@
+import os
+import subprocess
+import multiprocessing
+from os import path
+from collections import deque
+
+import numpy as np
+from PIL import Image, ImageDraw
+from igraph.drawing.cairo.utils import find_cairo
+
+cairo = find_cairo()
+
+# Rendering of independent frames in a pool of worker processes. The pool uses the fork start
+# method: the plotting scripts run at module level, so spawned workers would re-run the whole
+# script, while forked workers inherit the data computed before the pool is created (timelines,
+# edge lists, layouts) and only need to receive a small job description.
+
+def get_num_workers(num_workers):
+    if not num_workers or num_workers < 1:
+        return os.cpu_count() or 1
+    return num_workers
+
+# Calls render_job on each of the jobs and yields the results in the same order as the jobs.
+# At most 2 jobs per worker are pending at any time, so the jobs can be generated lazily.
+def render_jobs(render_job, jobs, num_workers=0):
+    num_workers = get_num_workers(num_workers)
+    if num_workers == 1:
+        for job in jobs:
+            yield render_job(job)
+        return
+
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(num_workers) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(render_job, (job,)))
+            if 2 * num_workers <= len(pending):
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+# Pixels of a cairo ARGB32 image surface (stored as BGRA on little-endian machines) as an RGB
+# array of shape (height, width, 3)
+def get_surface_rgb(surface):
+    surface.flush()
+    width = surface.get_width()
+    height = surface.get_height()
+    data = np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(height, surface.get_stride())
+    return data[:, :4 * width].reshape(height, width, 4)[:, :, 2::-1].copy()
+
+# Cairo image surface from an RGBA array of shape (height, width, 4)
+def get_rgba_surface(rgba):
+    height, width = rgba.shape[:2]
+    stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width)
+    alpha = rgba[:, :, 3:].astype(np.uint16)
+    # Cairo uses premultiplied alpha
+    data = np.zeros((height, stride // 4, 4), dtype=np.uint8)
+    data[:, :width, 2::-1] = (rgba[:, :, :3] * alpha + 127) // 255
+    data[:, :width, 3] = rgba[:, :, 3]
+    return cairo.ImageSurface.create_for_data(bytearray(data.tobytes()), cairo.FORMAT_ARGB32, width, height, stride)
+
+# Overlay with a line of text in a TrueType font, to be painted on the frames with paint_overlay.
+# Cairo cannot load font files, so the text is rasterized once with PIL, placed as if drawn with
+# ImageDraw.text at the point where the overlay is painted.
+def make_text_overlay(text, font, fill=(0, 0, 0)):
+    left, top, right, bottom = font.getbbox(text)
+    image = Image.new("RGBA", (max(right, 1), max(bottom, 1)), fill + (0,))
+    ImageDraw.Draw(image).text((0, 0), text, fill=fill + (255,), font=font)
+    return get_rgba_surface(np.asarray(image))
+
+# Paints an overlay on the surface the frame was rendered to, with its top-left corner at (x, y)
+def paint_overlay(surface, overlay, x, y):
+    ctx = cairo.Context(surface)
+    ctx.set_source_surface(overlay, x, y)
+    ctx.paint()
+
+# Encodes a movie by sending the raw RGB frames to ffmpeg over stdin, so the frames are not written
+# to disk and read back as PNG files. If png_every is larger than 0, every png_every-th frame is also
+# saved as frame-N.png in png_folder, for previews. The movie is written to a temporary file that is
+# renamed when it is complete.
+class MovieWriter:
+    def __init__(self, movie_fn, width, height, fps=25, png_folder=None, png_every=0):
+        self.movie_fn = movie_fn
+        self.tmp_fn = movie_fn + ".part"
+        self.width = width
+        self.height = height
+        self.png_folder = png_folder
+        self.png_every = png_every
+
+        if path.exists(movie_fn):
+            os.remove(movie_fn)
+        cmd = ["ffmpeg", "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", str(width) + "x" + str(height), "-r", str(fps), "-i", "-",
+               "-c:v", "libx264", "-pix_fmt", "yuv420p", "-f", "mp4", self.tmp_fn]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    # Writes the frame, repeated the given number of times so a frame that does not change is only
+    # rendered once
+    def write(self, frame, rgb, repeat=1):
+        if rgb.shape != (self.height, self.width, 3):
+            raise ValueError("Frame " + str(frame) + " has size " + str(rgb.shape) + ", expected " +
+                             str((self.height, self.width, 3)))
+        data = np.ascontiguousarray(rgb, dtype=np.uint8).tobytes()
+        for i in range(0, repeat):
+            self.process.stdin.write(data)
+
+        if 0 < self.png_every:
+            for f in range(frame, frame + repeat):
+                if f % self.png_every == 0:
+                    Image.fromarray(rgb).save(path.join(self.png_folder, "frame-" + str(f) + ".png"))
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            print("ffmpeg exited with code", self.process.returncode)
+        else:
+            os.replace(self.tmp_fn, self.movie_fn)
@@ -0,0 +1,115 @@
+import os, re, argparse, subprocess
+from os import path
+
+# Rendering of the movies in segments of consecutive frames, so a long movie can be split across
+# several machines and a failed run does not start again from the first frame:
+#
+# --frames START:END  renders the frames START <= frame < END
+# --shard i/N         renders the i-th of N parts of the movie (1 <= i <= N)
+# --resume            skips the segments that were already rendered
+# --merge             joins the segments into the movie without re-encoding them
+#
+# With any of these options the movies are written as segments of segment_frames frames in a
+# folder next to the movie. A segment file only exists once it is complete. Without options the
+# whole movie is rendered in a single file, as before.
+
+segment_frames = 1000
+
+def parse_render_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="range of frames to render, START:END")
+    parser.add_argument("--shard", help="part of the movie to render, i/N")
+    parser.add_argument("--resume", action="store_true", help="skip the segments that already exist")
+    parser.add_argument("--merge", action="store_true", help="join the rendered segments into the movie")
+    return parser.parse_args(args)
+
+def is_segmented(options):
+    return options.frames or options.shard or options.resume or options.merge
+
+def get_segment_folder(movie_fn):
+    return path.splitext(movie_fn)[0] + "-segments"
+
+# Range of frames [start, end) selected by the --frames and --shard options. The shards are made of
+# whole segments, so different shards never write the same segment.
+def get_frame_range(nframes, options):
+    start = 0
+    end = nframes
+    if options.frames:
+        s, e = options.frames.split(":")
+        if s: start = int(s)
+        if e: end = min(int(e), nframes)
+    if options.shard:
+        i, n = [int(v) for v in options.shard.split("/")]
+        if i < 1 or n < i:
+            raise ValueError("Invalid shard " + options.shard + ", should be i/N with 1 <= i <= N")
+        nsegments = (nframes + segment_frames - 1) // segment_frames
+        start = max(start, ((i - 1) * nsegments // n) * segment_frames)
+        end = min(end, (i * nsegments // n) * segment_frames)
+    return start, end
+
+# Segments to render as (first frame, end frame, file name). The segments are aligned to multiples
+# of segment_frames, except at the ends of a --frames range.
+def get_movie_segments(movie_fn, nframes, options):
+    if not is_segmented(options):
+        return [(0, nframes, movie_fn)]
+
+    folder = get_segment_folder(movie_fn)
+    if not path.exists(folder):
+        os.makedirs(folder)
+
+    start, end = get_frame_range(nframes, options)
+    segments = []
+    s = start
+    while s < end:
+        e = min((s // segment_frames + 1) * segment_frames, end)
+        fn = path.join(folder, "segment-%08d-%08d.mp4" % (s, e))
+        if options.resume and path.exists(fn):
+            print("Skipping rendered segment", path.basename(fn))
+        else:
+            segments += [(s, e, fn)]
+        s = e
+    return segments
+
+# Runs of held frames (frame, number of frames) clipped to the segment [start, end), as
+# (rendered frame, first output frame, number of frames)
+def get_segment_runs(frame_runs, start, end):
+    runs = []
+    for frame, hold in frame_runs:
+        s = max(frame, start)
+        e = min(frame + hold, end)
+        if s < e:
+            runs += [(frame, s, e - s)]
+    return runs
+
+# Joins the segments of the movie with the ffmpeg concat demuxer, copying the streams. Returns
+# false if some frames are missing.
+def merge_segments(movie_fn, nframes):
+    folder = get_segment_folder(movie_fn)
+    segments = {}
+    if path.exists(folder):
+        for fn in os.listdir(folder):
+            m = re.fullmatch(r"segment-(\d+)-(\d+)\.mp4", fn)
+            if m:
+                s, e = int(m.group(1)), int(m.group(2))
+                # Overlapping segments from different --frames ranges, use the longest one
+                if s not in segments or segments[s][0] < e:
+                    segments[s] = (e, path.join(folder, fn))
+
+    files = []
+    frame = 0
+    while frame < nframes:
+        if frame not in segments:
+            print("Cannot merge", path.basename(movie_fn) + ", the segment starting at frame", frame, "is missing")
+            return False
+        frame, fn = segments[frame]
+        files += [fn]
+
+    list_fn = path.join(folder, "segments.txt")
+    with open(list_fn, "w") as f:
+        for fn in files:
+            f.write("file '" + path.abspath(fn) + "'\n")
+
+    if path.exists(movie_fn):
+        os.remove(movie_fn)
+    cmd = ["ffmpeg", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_fn, "-c", "copy", movie_fn]
+    return subprocess.run(cmd).returncode == 0
@@ -0,0 +1,69 @@
+import gzip
+
+import numpy as np
+
+from Bio import bgzf
+
+# Writers of the sequence files of plot_sequences.py. The writers take iterables of records and
+# write them one at a time, so the sequences can be generated as they are written and the full
+# sequences are never all in memory at the same time. The files can be compressed with gzip or with
+# bgzip (blocked gzip, which can be indexed by samtools/tabix and read with any gzip reader).
+
+compressions = {None: "", "none": "", "gzip": ".gz", "bgzip": ".gz"}
+
+# File name with the extension of the compression
+def get_sequence_fn(fn, compression=None):
+    return fn + compressions[compression]
+
+def open_sequence_file(fn, mode="r", compression=None):
+    if compression == "gzip":
+        return gzip.open(fn, mode + "t")
+    elif compression == "bgzip":
+        if mode == "w":
+            return bgzf.open(fn, "wt")
+        # bgzip files are also valid gzip files
+        return gzip.open(fn, mode + "t")
+    else:
+        return open(fn, mode)
+
+# Writes (name, sequence) records in FASTA format
+def write_fasta(f, records):
+    for name, seq in records:
+        f.write(">" + name + "\n" + seq + "\n")
+
+# Writes (name, sequence) records in PHYLIP format, with the names padded to 10 characters and no
+# separator between the name and the sequence, so the number of sequences and their length must be
+# known in advance
+def write_phylip(f, records, nseqs, length):
+    f.write(str(nseqs) + " " + str(length) + "\n")
+    for name, seq in records:
+        f.write(name.ljust(10) + seq + "\n")
+
+# (name, sequence) records of the SNP-only alignment, the bases of each sequence at the variable
+# positions, from the (nseqs, npositions) array of ASCII codes
+def get_snp_records(names, snps):
+    for name, row in zip(names, snps):
+        yield name, row.tobytes().decode("ascii")
+
+# Writes the variable positions in VCF format, with one haploid genotype column per sequence: 0 for
+# the reference base and 1, 2... for the alternate bases in the order of the ALT column
+def write_vcf(f, names, snps, positions, ref_bases, chrom="1", length=None):
+    f.write("##fileformat=VCFv4.2\n")
+    if length is None:
+        f.write("##contig=<ID=" + chrom + ">\n")
+    else:
+        f.write("##contig=<ID=" + chrom + ",length=" + str(length) + ">\n")
+    f.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    f.write("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + list(names)) + "\n")
+
+    for k in range(0, len(positions)):
+        column = snps[:, k]
+        ref = ref_bases[k]
+        alts = np.unique(column[column != ref])
+        # Index of each base in [ref] + alts, as a genotype
+        codes = np.zeros(256, dtype=np.int64)
+        codes[alts] = np.arange(1, len(alts) + 1)
+        genotypes = codes[column]
+        f.write(chrom + "\t" + str(positions[k] + 1) + "\t.\t" + chr(ref) + "\t" +
+                ",".join(chr(b) for b in alts) + "\t.\tPASS\t.\tGT\t" +
+                "\t".join(map(str, genotypes.tolist())) + "\n")
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+from data_store import infection_event, outcome_event
+
+# Status of every participant over the time steps of an animation, stored as an int8 matrix of
+# shape (nsteps, nusers) with the coded status values:
+# 0 Susceptible, 1 Infected (index case), 2 Infected (from someone else), 3 Dead, 4 Recovered,
+# 5 Vaccinated
+# Step s covers the events in the window (tmin + s * delta, tmin + (s + 1) * delta].
+
+num_status = 6
+
+# Number of windows in the loop "while t <= tmax: t0 = t; t += delta"
+def get_num_steps(tmin, tmax, delta):
+    return int((tmax - tmin) // delta) + 1
+
+def get_step_index(times, tmin, delta):
+    return np.ceil((np.asarray(times, dtype=float) - tmin) / delta).astype(int) - 1
+
+# Replays the infection and outcome events once, in time order, using the normalized event columns
+# (see data_store.normalize_events). The status at each step is the status of the previous step with
+# the last infection of each participant applied on top of it (the peers of those last infections
+# that were still susceptible become index cases) and then the last outcome, which takes precedence
+# over the infection unless it is a recovery followed by a new infection. If cumulative is true, the
+# last infections and outcomes are taken from all the events up to the end of the step, including
+# the events before tmin, otherwise only from the events in the window of the step.
+def build_status_timeline(events, nusers, tmin, nsteps, delta, cumulative=False, print_data_warnings=True):
+    timeline = np.zeros((nsteps, nusers), dtype=np.int8)
+
+    kind = events["kind"].values
+    sel = (kind == infection_event) | (kind == outcome_event)
+    times = events["time"].values[sel]
+    is_outcome = (kind[sel] == outcome_event)
+    src_nodes = events["src_node"].values[sel]
+    dst_nodes = events["dst_node"].values[sel]
+    outcomes = events["outcome"].values[sel]
+    users = events["user_id"].values[sel]
+
+    steps = get_step_index(times, tmin, delta)
+    if cumulative:
+        steps = np.maximum(steps, -1)
+    order = np.argsort(steps, kind="stable")
+
+    # Last infection (with its infecting peer, or -1) and last outcome of each participant
+    inf_code = np.zeros(nusers, dtype=np.int8)
+    inf_time = np.full(nusers, -np.inf)
+    inf_peer = np.full(nusers, -1, dtype=np.int64)
+    out_user = np.zeros(nusers, dtype=users.dtype)
+    out_code = np.zeros(nusers, dtype=np.int8)
+    out_time = np.full(nusers, -np.inf)
+    warned = np.zeros(nusers, dtype=bool)
+
+    status = np.zeros(nusers, dtype=np.int8)
+    bounds = np.searchsorted(steps[order], np.arange(-1, nsteps + 1))
+    for step in range(-1, nsteps):
+        rows = order[bounds[step + 1]:bounds[step + 2]]
+        inf_rows = rows[~is_outcome[rows]]
+        out_rows = rows[is_outcome[rows]]
+        if not cumulative and step < 0: continue
+        # The rows are in time order, so the last assignment of each participant wins
+        inf_code[dst_nodes[inf_rows]] = outcomes[inf_rows]
+        inf_time[dst_nodes[inf_rows]] = times[inf_rows]
+        inf_peer[dst_nodes[inf_rows]] = np.where(outcomes[inf_rows] == 2, src_nodes[inf_rows], -1)
+        out_code[dst_nodes[out_rows]] = outcomes[out_rows]
+        out_time[dst_nodes[out_rows]] = times[out_rows]
+        out_user[dst_nodes[out_rows]] = users[out_rows]
+        if step < 0: continue
+
+        infecting = np.zeros(nusers, dtype=bool)
+        infecting[inf_peer[-1 < inf_peer]] = True
+        marked = infecting & (inf_code == 0) & (status == 0)
+        if print_data_warnings:
+            for idx in np.flatnonzero(marked):
+                print("Infecting peer did not have correct status", idx)
+        status = np.where(0 < inf_code, inf_code, np.where(marked, 1, status)).astype(np.int8)
+
+        reinfected = (out_code == 4) & (out_time <= inf_time)
+        for idx in np.flatnonzero(reinfected & ~warned):
+            print(out_user[idx], "became reinfected after recovery from infection")
+        if cumulative:
+            warned |= reinfected
+        applied = (0 < out_code) & ~reinfected
+        status[applied] = out_code[applied]
+        timeline[step] = status
+
+        if not cumulative:
+            # Only the events of the window count, the status carries over to the next step
+            inf_code[dst_nodes[rows]] = 0
+            inf_time[dst_nodes[rows]] = -np.inf
+            inf_peer[dst_nodes[rows]] = -1
+            out_code[dst_nodes[rows]] = 0
+            out_time[dst_nodes[rows]] = -np.inf
+
+    return timeline
+
+# Array to look up the vertex colors from a status row
+def get_status_palette(status_color):
+    palette = np.empty(num_status, dtype=object)
+    for k in status_color:
+        palette[k] = status_color[k]
+    return palette
+
+# Mean and standard deviation of the number of infections caused by each node with at least one
+# edge in the infection network of each window, from the edges of all the windows at once, where
+# edge_windows is the window of each edge. The windows without edges have a mean and std of 0.
+def get_window_r_stats(edges, edge_windows, nwindows, nusers):
+    src = edge_windows * nusers + edges[:, 0]
+    dst = edge_windows * nusers + edges[:, 1]
+    nodes, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+    nout = np.bincount(inverse[:len(src)], minlength=len(nodes))
+    node_windows = nodes // nusers
+    count = np.maximum(np.bincount(node_windows, minlength=nwindows), 1)
+    mean = np.bincount(node_windows, weights=nout, minlength=nwindows) / count
+    var = np.bincount(node_windows, weights=(nout - mean[node_windows]) ** 2, minlength=nwindows) / count
+    return mean, np.sqrt(var)
+
+# R effective in consecutive windows of k steps for each of the r_scales (in number of steps), as
+# tables of (time, r_mean, r_std). The infection events are selected and sorted by step once, the
+# infections that ended in each window with any are de-duplicated by a new InfectionBuilder, as the
+# transmission graph of that window, and the stats of all the windows come from a few bincounts.
+def build_r_timelines(events, nusers, tmin, tmax, delta, new_infection_builder, r_scales):
+    sel = (events["kind"].values == infection_event) & (-1 < events["src_node"].values)
+    rows = np.flatnonzero(sel)
+    steps = get_step_index(events["time"].values[sel], tmin, delta)
+    order = np.lexsort((rows, steps))
+    steps = steps[order]
+    infections = events.iloc[rows[order]]
+
+    r_tables = {}
+    for k in r_scales:
+        nwindows = get_num_steps(tmin, tmax, k * delta)
+        i0, i1 = np.searchsorted(steps, [0, nwindows * k])
+        bounds = i0 + np.searchsorted(steps[i0:i1] // k, np.arange(nwindows + 1))
+
+        edges = []
+        edge_windows = []
+        for w in np.flatnonzero(bounds[:-1] < bounds[1:]):
+            wedges = new_infection_builder().add(infections.iloc[bounds[w]:bounds[w + 1]]).edges
+            edges += wedges
+            edge_windows += [w] * len(wedges)
+
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+        r_mean, r_std = get_window_r_stats(edges, np.array(edge_windows, dtype=np.int64), nwindows, nusers)
+        times = tmin + (np.arange(nwindows) + 1) * (k * delta)
+        r_tables[k] = pd.DataFrame({"time": times, "r_mean": r_mean, "r_std": r_std})
+
+    return r_tables
+
+# Series of the animated charts: status counts, number of contacts and number of new infections at
+# each step, plus the R effective for each of the r_scales (see build_r_timelines). The status
+# counts of all the steps come from a single bincount over the status matrix. new_infection_builder
+# returns an empty InfectionBuilder and get_contact_list aggregates the contacts of a window.
+def build_chart_timeline(event_index, status_timeline, tmin, tmax, delta, new_infection_builder, get_contact_list,
+                         r_scales=[]):
+    nsteps, nusers = status_timeline.shape
+
+    cells = np.arange(nsteps)[:, None] * num_status + status_timeline.astype(np.int64)
+    counts = np.bincount(cells.ravel(), minlength=nsteps * num_status).reshape(nsteps, num_status)
+
+    ncontacts = np.zeros(nsteps, dtype=int)
+    ninfections = np.zeros(nsteps, dtype=int)
+    for s in range(nsteps):
+        t0 = tmin + s * delta
+        t = t0 + delta
+
+        # We want to include contact and infection events that either started or ended between t0 and t
+        tevents = event_index.window(t0, t)
+        tinfections = new_infection_builder().add(tevents).edges
+        tcontacts = get_contact_list(tevents, tinfections)
+        ncontacts[s] = len(tcontacts[1])
+        ninfections[s] = len(tinfections)
+
+    table = pd.DataFrame({"time": tmin + (np.arange(nsteps) + 1) * delta,
+                          "susceptible": counts[:, 0], "infected": counts[:, 1] + counts[:, 2], "dead": counts[:, 3],
+                          "recovered": counts[:, 4], "vaccinated": counts[:, 5],
+                          "contacts": ncontacts, "infections": ninfections})
+    r_tables = build_r_timelines(event_index.events, nusers, tmin, tmax, delta, new_infection_builder, r_scales)
+
+    return table, r_tables
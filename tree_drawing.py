@@ -0,0 +1,153 @@
+import numpy as np
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+
+# Rectangular drawing of a phylogenetic tree (as Phylo.draw, with the first leaf at the top and the
+# x coordinate of each clade at its distance from the root), for trees with thousands of leaves.
+# The tree is walked once to store it as arrays in preorder, and the positions of the clades are
+# computed level by level on the arrays. All the branches are drawn as a single LineCollection and
+# the collapsed clades as a single PolyCollection, so the cost of the drawing does not depend on
+# the number of matplotlib artists, and the height of the canvas grows with the number of rows.
+
+# Arrays of the tree in preorder: the parent of each clade (-1 for the root), its branch length,
+# its first and last child (-1 for the leaves), its depth in number of branches, and the clades
+def get_tree_arrays(tree):
+    clades = []
+    parents = []
+    levels = []
+    stack = [(tree.root, -1, 0)]
+    while stack:
+        clade, parent, level = stack.pop()
+        parents += [parent]
+        levels += [level]
+        clades += [clade]
+        k = len(clades) - 1
+        for child in reversed(clade.clades):
+            stack.append((child, k, level + 1))
+
+    n = len(clades)
+    parents = np.array(parents, dtype=np.int64)
+    lengths = np.array([clade.branch_length or 0 for clade in clades], dtype=float)
+    lengths[0] = 0
+
+    # In preorder the children of each clade appear in order, so the first child is the first
+    # occurrence of the clade in parents and the last child the last occurrence
+    first_child = np.full(n, -1, dtype=np.int64)
+    last_child = np.full(n, -1, dtype=np.int64)
+    k = np.arange(1, n)
+    last_child[parents[1:]] = k
+    first_child[parents[1:][::-1]] = k[::-1]
+
+    return parents, lengths, first_child, last_child, np.array(levels, dtype=np.int64), clades
+
+# Nodes of each level, from the root down
+def get_level_nodes(levels):
+    order = np.argsort(levels, kind="stable")
+    bounds = np.searchsorted(levels[order], np.arange(0, levels.max() + 2))
+    return [order[bounds[l]:bounds[l + 1]] for l in range(0, levels.max() + 1)]
+
+# Positions of the clades. The clades whose leaves are all within collapse_distance of the clade
+# (and that are not inside another collapsed clade) are collapsed into a single row, the returned
+# collapsed array marks them and hidden the clades inside them.
+def get_tree_positions(parents, lengths, first_child, last_child, levels, collapse_distance=None):
+    n = len(parents)
+    level_nodes = get_level_nodes(levels)
+    is_leaf = first_child < 0
+
+    x = np.zeros(n)
+    for nodes in level_nodes[1:]:
+        x[nodes] = x[parents[nodes]] + lengths[nodes]
+    # As Phylo.draw, a tree without branch lengths is drawn with unit branch lengths
+    if not x.max():
+        x = levels.astype(float)
+
+    # Number of leaves and distance to the farthest leaf below each clade
+    nleaves = is_leaf.astype(np.int64)
+    max_x = x.copy()
+    for nodes in reversed(level_nodes[1:]):
+        np.add.at(nleaves, parents[nodes], nleaves[nodes])
+        np.maximum.at(max_x, parents[nodes], max_x[nodes])
+
+    collapsed = np.zeros(n, dtype=bool)
+    hidden = np.zeros(n, dtype=bool)
+    if collapse_distance is not None:
+        collapsible = ~is_leaf & (max_x - x <= collapse_distance)
+        collapsed[0] = collapsible[0]
+        for nodes in level_nodes[1:]:
+            p = parents[nodes]
+            hidden[nodes] = hidden[p] | collapsed[p]
+            collapsed[nodes] = collapsible[nodes] & ~hidden[nodes]
+
+    # One row for each visible leaf and each collapsed clade, in preorder, and the inner clades in
+    # the middle of their first and last child
+    rows = (is_leaf | collapsed) & ~hidden
+    y = np.cumsum(rows).astype(float) - 1
+    for nodes in reversed(level_nodes[:-1]):
+        nodes = nodes[~is_leaf[nodes] & ~collapsed[nodes] & ~hidden[nodes]]
+        y[nodes] = (y[first_child[nodes]] + y[last_child[nodes]]) / 2
+    return x, y, max_x, nleaves, collapsed, hidden, rows
+
+# Draws the tree to fn (any format supported by matplotlib, with the size of the canvas set by the
+# number of rows) and returns the number of rows. Leaves are labelled with their names and collapsed
+# clades with the name of their first leaf and the number of leaves.
+def draw_tree(tree, fn, collapse_distance=None, width=12, row_height=0.14, max_height=200, dpi=100):
+    parents, lengths, first_child, last_child, levels, clades = get_tree_arrays(tree)
+    x, y, max_x, nleaves, collapsed, hidden, rows = get_tree_positions(parents, lengths, first_child,
+                                                                       last_child, levels, collapse_distance)
+    nrows = int(rows.sum())
+
+    # PDF pages cannot be larger than 200 inches, very large trees are drawn with smaller rows
+    height = min(max_height, nrows * row_height + 1)
+    row_points = 72 * (height - 1) / max(nrows, 1)
+    font_size = min(8, 0.8 * row_points)
+
+    fig = Figure(figsize=(width, height), facecolor="white")
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0.02, 0.5 / height, 0.8, (height - 1) / height])
+
+    # Horizontal branches of the visible clades, vertical lines of the expanded inner clades
+    visible = np.flatnonzero(~hidden)[1:]
+    inner = np.flatnonzero((first_child >= 0) & ~collapsed & ~hidden)
+    segments = np.empty((len(visible) + len(inner), 2, 2))
+    segments[:len(visible), 0, 0] = x[parents[visible]]
+    segments[:len(visible), 1, 0] = x[visible]
+    segments[:len(visible), :, 1] = y[visible, None]
+    segments[len(visible):, :, 0] = x[inner, None]
+    segments[len(visible):, 0, 1] = y[first_child[inner]]
+    segments[len(visible):, 1, 1] = y[last_child[inner]]
+    ax.add_collection(LineCollection(segments, colors="black", linewidths=0.5))
+
+    # Collapsed clades as wedges from the clade to its farthest leaf
+    wedges = np.flatnonzero(collapsed)
+    if 0 < len(wedges):
+        polygons = np.empty((len(wedges), 3, 2))
+        polygons[:, 0, 0] = x[wedges]
+        polygons[:, 0, 1] = y[wedges]
+        polygons[:, 1:, 0] = max_x[wedges, None]
+        polygons[:, 1, 1] = y[wedges] - 0.4
+        polygons[:, 2, 1] = y[wedges] + 0.4
+        ax.add_collection(PolyCollection(polygons, facecolors="lightgray", edgecolors="black", linewidths=0.5))
+
+    pad = 0.01 * ((max_x[0] - x.min()) or 1)
+    if 1 <= font_size:
+        for k in np.flatnonzero(rows):
+            if collapsed[k]:
+                # First leaf of the clade
+                leaf = k
+                while 0 <= first_child[leaf]:
+                    leaf = first_child[leaf]
+                label = str(clades[leaf].name) + " + " + str(nleaves[k] - 1) + " more"
+                ax.text(max_x[k] + pad, y[k], label, va="center", fontsize=font_size)
+            elif clades[k].name is not None:
+                ax.text(x[k] + pad, y[k], str(clades[k].name), va="center", fontsize=font_size)
+
+    ax.set_xlim(x.min() - pad, max_x[0] + pad)
+    ax.set_ylim(nrows - 0.5, -0.5)
+    ax.set_yticks([])
+    for side in ("left", "right", "top"):
+        ax.spines[side].set_visible(False)
+    ax.set_xlabel("branch length")
+    fig.savefig(fn, dpi=dpi)
+    return nrows